@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cisco_Ready_Parser.settings')
 
 application = get_asgi_application()
+
+from website.worker_pool import warm_pool
+
+warm_pool()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
 
@@ -128,3 +129,54 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Parser worker pool
+# Number of worker processes used for multi-file uploads, None uses every available core.
+
+PARSER_WORKERS = None
+
+# Start the workers as soon as the server has loaded the application instead of on
+# the first upload, they import pandas and openpyxl before any file arrives.
+
+PARSER_WARM_WORKERS = True
+
+# Processes the four sheets of large xlsx reports are rendered on side by side. Every
+# worker of the pool above starts its own once it writes its first large report.
+# None uses one per sheet, limited to the available cores, 0 writes the sheets
+# one after another.
+
+PARSER_SHEET_WORKERS = None
+
+# Seconds a finished parse job and its files are kept before they are removed.
+
+PARSER_JOB_RETENTION = 3600
+
+# Seconds after which the scratch folder of a request is removed even if the request
+# never cleaned it up, e.g. because its process was killed.
+
+PARSER_SCRATCH_RETENTION = 24 * 3600
+
+# Rows of a report read and aggregated at a time. Set it for exports that do not fit
+# in the memory of a worker, memory then depends on it and on the number of distinct
+# Product IDs and dates instead of the size of the report. 0 reads whole reports,
+# which is faster and lets the input cache below be used.
+
+PARSER_CHUNK_ROWS = 0
+
+# Cache of normalized customer data keyed by the content hash of the uploaded file.
+# Set PARSER_INPUT_CACHE_BYTES to 0 to disable it.
+
+PARSER_INPUT_CACHE_DIR = os.path.join("media", "cache", "input")
+PARSER_INPUT_CACHE_BYTES = 1024**3
+
+# Cache of finished outputs keyed by the content hash of the uploaded file and every
+# form option, an identical request is answered without parsing.
+# Set PARSER_OUTPUT_CACHE_BYTES to 0 to disable it.
+
+PARSER_OUTPUT_CACHE_DIR = os.path.join("media", "cache", "output")
+PARSER_OUTPUT_CACHE_BYTES = 1024**3
+
+# Aggregated results of every run that asked for a changes report, one per customer,
+# the next run of the same customer is compared with it.
+
+PARSER_SNAPSHOT_DIR = os.path.join("media", "snapshots")
@@ -15,10 +15,28 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from website.views import upload_file, upload_folder, home
+from website.views import (
+    upload_file,
+    upload_folder,
+    home,
+    create_parse_job,
+    job_status,
+    job_events,
+    job_file_download,
+    job_download,
+    job_cancel,
+    metrics_view,
+)
 
 urlpatterns = [
     path("", home, name="home"),
     path("parse/single-file", upload_file, name="upload_file"),
     path("parse/multi-file", upload_folder, name="upload_folder"),
+    path("jobs", create_parse_job, name="create_job"),
+    path("jobs/<str:job_id>", job_status, name="job_status"),
+    path("jobs/<str:job_id>/events", job_events, name="job_events"),
+    path("jobs/<str:job_id>/files/<int:index>", job_file_download, name="job_file"),
+    path("jobs/<str:job_id>/download", job_download, name="job_download"),
+    path("jobs/<str:job_id>/cancel", job_cancel, name="job_cancel"),
+    path("metrics", metrics_view, name="metrics"),
 ]
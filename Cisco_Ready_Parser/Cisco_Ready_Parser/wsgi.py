@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Cisco_Ready_Parser.settings')
 
 application = get_wsgi_application()
+
+from website.worker_pool import warm_pool
+
+warm_pool()
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import uuid
+
+
+def content_hash(path):
+    """
+    Description: SHA-256 of a file's content, used as a cache key.
+
+    Args:
+        path (str|file): Path or binary file object to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    if hasattr(path, "read"):
+        path.seek(0)
+        for chunk in iter(lambda: path.read(1024 * 1024), b""):
+            digest.update(chunk)
+        path.seek(0)
+    else:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Description: Folder of cache entries with a size budget. Each entry is one file
+                 named after its key. The modification time of an entry is bumped
+                 on every hit and the least recently used entries are evicted
+                 once the folder grows over max_bytes.
+
+    Args:
+        path (str): Folder the entries are stored in.
+        max_bytes (int): Size budget of the folder.
+        suffix (str): File extension of the entries.
+    """
+
+    def __init__(self, path, max_bytes, suffix=""):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+    def entry_path(self, key):
+        return os.path.join(self.path, f"{key}{self.suffix}")
+
+    def get(self, key):
+        """
+        Description: Looks up an entry and marks it as recently used.
+
+        Args:
+            key (str): Key of the entry.
+
+        Returns:
+            str: Path of the entry, None on a miss.
+        """
+        entry = self.entry_path(key)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def put(self, key, write):
+        """
+        Description: Stores an entry, then evicts old entries to stay within budget.
+                     The entry is written to a temporary file first, so readers
+                     never see a partially written entry.
+
+        Args:
+            key (str): Key of the entry.
+            write (callable): Called with the path to write the entry to.
+
+        Returns:
+            str: Path of the entry.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        entry = self.entry_path(key)
+        tmp_path = os.path.join(self.path, f".{uuid.uuid4().hex}.tmp")
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, entry)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+        return entry
+
+    def evict(self):
+        """
+        Description: Removes the least recently used entries until the folder fits the budget.
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith("."):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def input_cache():
+    """
+    Description: Cache of normalized customer data configured by the
+                 PARSER_INPUT_CACHE_DIR and PARSER_INPUT_CACHE_BYTES settings.
+
+    Returns:
+        DiskCache: The cache, None when it is disabled.
+    """
+    from django.conf import settings
+
+    max_bytes = getattr(settings, "PARSER_INPUT_CACHE_BYTES", 0)
+    if not max_bytes:
+        return None
+    return DiskCache(settings.PARSER_INPUT_CACHE_DIR, max_bytes, suffix=".feather")
+
+
+def output_cache():
+    """
+    Description: Cache of finished outputs configured by the PARSER_OUTPUT_CACHE_DIR
+                 and PARSER_OUTPUT_CACHE_BYTES settings.
+
+    Returns:
+        DiskCache: The cache, None when it is disabled.
+    """
+    from django.conf import settings
+
+    max_bytes = getattr(settings, "PARSER_OUTPUT_CACHE_BYTES", 0)
+    if not max_bytes:
+        return None
+    return DiskCache(settings.PARSER_OUTPUT_CACHE_DIR, max_bytes)
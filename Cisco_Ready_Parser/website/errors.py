@@ -0,0 +1,2 @@
+class ParseCancelled(Exception):
+    """Raised inside the Parser when its cancel event has been set."""
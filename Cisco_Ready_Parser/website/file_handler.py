@@ -1,4 +1,14 @@
 import os
+import shutil
+import time
+import uuid
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.text import get_valid_filename
+
+# Every request working on files on disk gets its own folder in here.
+SCRATCH_PATH = os.path.join("media", "scratch")
+OUTPUT_FORMATS = ["xlsx", "csv", "jsonl", "parquet"]
 
 
 def handle_uploaded_file(file, path):
@@ -13,22 +23,81 @@ def handle_uploaded_file(file, path):
             destination.write(chunk)
 
 
-def remove_files():
+def uploaded_file_source(file):
+    """
+    Description: Gives a pool worker access to an uploaded file without copying it to disk.
+                 Small uploads are kept in memory by Django and their content is sent
+                 to the worker, large uploads are already spooled to a temporary file
+                 on disk that the worker reads itself.
+    Args:
+        file (django.core.files.uploadedfile.UploadedFile): Uploaded file we want to parse.
+
+    Returns:
+        str|bytes: Path of the spooled temporary file, or the content of the in-memory file.
+    """
+    if hasattr(file, "temporary_file_path"):
+        return file.temporary_file_path()
+    file.seek(0)
+    return file.read()
+
+
+def create_scratch_dir():
+    """
+    Description: Creates a folder, private to one request, holding its uploaded files
+                 in unparsed/ and its results in parsed/. Concurrent requests, worker
+                 processes and hosts never see or remove each other's files.
+                 Scratch folders left behind by a crashed process are removed once
+                 they are older than the PARSER_SCRATCH_RETENTION setting.
+
+    Returns:
+        str: Path of the new folder.
+    """
+    remove_expired_scratch_dirs()
+    path = os.path.join(SCRATCH_PATH, uuid.uuid4().hex)
+    os.makedirs(os.path.join(path, "unparsed"))
+    os.makedirs(os.path.join(path, "parsed"))
+    return path
+
+
+def remove_scratch_dir(path):
     """
-    Description: Remove the files after they have been processed.
+    Description: Remove the files of a request after they have been processed.
+    Args:
+        path (str): Scratch folder of the request, see create_scratch_dir.
     """
+    shutil.rmtree(path, ignore_errors=True)
 
-    file_cleaner("media/unparsed")
-    file_cleaner("media/parsed")
 
+def remove_expired_scratch_dirs():
+    from django.conf import settings
 
-def file_cleaner(path):
-    file_list = os.listdir(path)
+    retention = getattr(settings, "PARSER_SCRATCH_RETENTION", 24 * 3600)
+    if not os.path.isdir(SCRATCH_PATH):
+        return
+    for name in os.listdir(SCRATCH_PATH):
+        path = os.path.join(SCRATCH_PATH, name)
+        try:
+            expired = os.path.getmtime(path) + retention < time.time()
+        except FileNotFoundError:
+            continue
+        if expired:
+            remove_scratch_dir(path)
 
-    for file_name in file_list:
-        file_path = os.path.join(path, file_name)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
+
+def safe_file_name(name):
+    """
+    Description: The name as a plain file name, without folders or characters that
+                 are not safe in a path, so it cannot point outside of its folder.
+    Args:
+        name (str): Name given by the client.
+
+    Returns:
+        str: The cleaned name, empty if nothing usable is left.
+    """
+    try:
+        return get_valid_filename(os.path.basename(name))
+    except SuspiciousFileOperation:
+        return ""
 
 
 def format_file_name(file):
@@ -47,12 +116,26 @@ def format_file_name(file):
     return name
 
 
-def create_folders_for_uploaded_files():
+def parsed_file_name(name, output_format="xlsx"):
+    """
+    Description: Name of the parsed file of an upload.
+    Args:
+        name (str): Name of the upload, without extension.
+        output_format (str): xlsx, csv, jsonl or parquet.
+
+    Returns:
+        str: The name of the parsed file.
+    """
+    return f"{name}_parsed.{output_format}"
+
+
+def changes_file_name(name):
     """
-    Description: Uploaded files are stored in either media/parsed or
-                 media/unparsed. This function ensures the folders exist.
+    Description: Name of the workbook listing what changed since the previous run of an upload.
+    Args:
+        name (str): Name of the upload, without extension.
+
+    Returns:
+        str: The name of the workbook.
     """
-    unparsed_path = os.path.join("media", "unparsed")
-    parsed_path = os.path.join("media", "parsed")
-    os.makedirs(unparsed_path, exist_ok=True)
-    os.makedirs(parsed_path, exist_ok=True)
+    return f"{name}_changes.xlsx"
@@ -17,6 +17,34 @@ def minor_items_radio():
     return forms.ChoiceField(choices=CHOICES)
 
 
+def consolidate_radio():
+    YES = "yes"
+    NO = "no"
+    CHOICES = (
+        (NO, "no"),
+        (YES, "yes"),
+    )
+    return forms.ChoiceField(
+        choices=CHOICES,
+        required=False,
+        label="Also build one consolidated workbook",
+    )
+
+
+def changes_radio():
+    YES = "yes"
+    NO = "no"
+    CHOICES = (
+        (NO, "no"),
+        (YES, "yes"),
+    )
+    return forms.ChoiceField(
+        choices=CHOICES,
+        required=False,
+        label="Also return what changed since the previous run",
+    )
+
+
 def single_or_many_customers_per_file():
     SINGLE = "single customer"
     MULTIPLE = "multiple customers"
@@ -54,6 +82,16 @@ def output_date_format():
     )
     return forms.ChoiceField(choices=CHOICES)
 
+def output_format():
+    CHOICES = (
+        ("xlsx", "Excel workbook (.xlsx)"),
+        ("csv", "CSV (.csv)"),
+        ("jsonl", "JSON Lines (.jsonl)"),
+        ("parquet", "Parquet (.parquet)"),
+    )
+    return forms.ChoiceField(choices=CHOICES, required=False)
+
+
 class UploadFileForm(forms.Form):
     start_date = forms.DateField(widget=DateInput())
     end_date = forms.DateField(widget=DateInput())
@@ -64,6 +102,8 @@ class UploadFileForm(forms.Form):
     base_date_selection_on = time_filter_selection()
     file_type = single_or_many_customers_per_file()
     output_date_format = output_date_format()
+    output_format = output_format()
+    changes_report = changes_radio()
 
 
 class UploadFolderForm(forms.Form):
@@ -73,3 +113,6 @@ class UploadFolderForm(forms.Form):
     include_minor_items = minor_items_radio()
     base_date_selection_on = time_filter_selection()
     output_date_format = output_date_format()
+    output_format = output_format()
+    consolidate = consolidate_radio()
+    changes_report = changes_radio()
@@ -0,0 +1,273 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from . import metrics
+from .errors import ParseCancelled
+from .file_handler import handle_uploaded_file, parsed_file_name, safe_file_name
+from .threading_handle import CancelMarker, ProgressFile, threading_for_job
+from .worker_pool import get_pool
+
+JOBS_PATH = os.path.join("media", "jobs")
+FINAL_STATES = ("done", "failed", "cancelled")
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+def job_dir(job_id):
+    """
+    Description: Folder holding the uploads, results and state of a job.
+
+    Args:
+        job_id (str): ID of the job.
+
+    Returns:
+        str: Path of the job folder, None if the ID is malformed.
+    """
+    if not _JOB_ID.fullmatch(job_id):
+        return None
+    return os.path.join(JOBS_PATH, job_id)
+
+
+def _write_state(state):
+    folder = job_dir(state["id"])
+    tmp_path = os.path.join(folder, "job.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(folder, "job.json"))
+
+
+def _read_state(job_id):
+    folder = job_dir(job_id)
+    if folder is None:
+        return None
+    try:
+        with open(os.path.join(folder, "job.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _cancel_marker(job_id):
+    return CancelMarker(os.path.join(job_dir(job_id), "cancel"))
+
+
+def _progress_file(job_id, index):
+    return ProgressFile(os.path.join(job_dir(job_id), "progress", f"{index}.json"))
+
+
+def create_job(uploads, options):
+    """
+    Description: Stores the uploaded files in a new job folder and starts parsing
+                 them in the background. Returns without waiting for the parse.
+                 Besides its status, every file has the stage of its parse:
+                 queued, reading, aggregating, writing (sheet of sheets), then
+                 done, failed or cancelled, with its row counts and elapsed seconds.
+
+    Args:
+        uploads (list): (name, uploaded file) pairs, the names being plain file names,
+                        see safe_file_name.
+        options (dict): start_date, end_date, include_minor_items, output_date_format,
+                        selected_date_target, file_type and output_format passed to the Parser.
+
+    Returns:
+        dict: The state of the new job.
+    """
+    for name, _ in uploads:
+        if safe_file_name(name) != name:
+            raise ValueError(f"Invalid file name {name}")
+    remove_expired_jobs()
+    job_id = uuid.uuid4().hex
+    folder = job_dir(job_id)
+    os.makedirs(os.path.join(folder, "unparsed"))
+    os.makedirs(os.path.join(folder, "parsed"))
+    os.makedirs(os.path.join(folder, "progress"))
+
+    files = []
+    for name, file in uploads:
+        handle_uploaded_file(file, os.path.join(folder, "unparsed", name))
+        files.append(
+            {
+                "name": name,
+                "output": parsed_file_name(name, options["output_format"]),
+                "status": "queued",
+                "stage": "queued",
+                "sheet": None,
+                "sheets": None,
+                "input_rows": None,
+                "output_rows": None,
+                "elapsed": None,
+                "seconds": None,
+                "error": None,
+            }
+        )
+    state = {
+        "id": job_id,
+        "status": "queued",
+        "created": time.time(),
+        "options": options,
+        "files": files,
+    }
+    _write_state(state)
+    threading.Thread(target=_run_job, args=(job_id,), daemon=True).start()
+    return state
+
+
+def _run_job(job_id):
+    state = _read_state(job_id)
+    try:
+        _process_job(state)
+    except Exception as error:
+        print(f"JOB {job_id}: {error}")
+        state["status"] = "failed"
+        state["error"] = str(error)
+        state["finished"] = time.time()
+        _write_state(state)
+
+
+def _process_job(state):
+    job_id = state["id"]
+    folder = job_dir(job_id)
+    options = state["options"]
+    cancel = _cancel_marker(job_id)
+    pool = get_pool()
+    state["status"] = "running"
+    _write_state(state)
+
+    queued = list(enumerate(state["files"]))
+    pending = {}
+    progress = {}
+    while queued or pending:
+        if cancel.is_set():
+            for future in pending:
+                future.cancel()
+            for _, entry in queued:
+                entry["status"] = entry["stage"] = "cancelled"
+            queued = []
+        while queued and len(pending) < pool.max_pending:
+            index, entry = queued.pop(0)
+            progress[index] = _progress_file(job_id, index)
+            future = pool.submit(
+                threading_for_job,
+                os.path.join(folder, "unparsed", entry["name"]),
+                os.path.join(folder, "parsed", entry["output"]),
+                options["start_date"],
+                options["end_date"],
+                options["include_minor_items"],
+                options["output_date_format"],
+                options["selected_date_target"],
+                options["file_type"],
+                cancel.path,
+                options["output_format"],
+                progress[index].path,
+            )
+            entry["status"] = "running"
+            pending[future] = (index, entry)
+        if not pending:
+            break
+
+        done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+        for future in done:
+            index, entry = pending.pop(future)
+            if future.cancelled():
+                entry["status"] = entry["stage"] = "cancelled"
+                metrics.record_outcome("job", "cancelled")
+                continue
+            try:
+                result = future.result()
+                entry["seconds"] = entry["elapsed"] = result["seconds"]
+                entry["input_rows"] = result["stats"]["input_rows"]
+                entry["output_rows"] = result["stats"]["output_rows"]
+                entry["status"] = entry["stage"] = "done"
+                metrics.record_parse(result["stats"], result["seconds"], "job")
+            except ParseCancelled:
+                entry["status"] = entry["stage"] = "cancelled"
+                metrics.record_outcome("job", "cancelled")
+            except Exception as error:
+                entry["status"] = entry["stage"] = "failed"
+                entry["error"] = str(error)
+                metrics.record_outcome("job", "failed")
+        for index, entry in pending.values():
+            entry.update(progress[index].read() or {})
+        _write_state(state)
+
+    statuses = [entry["status"] for entry in state["files"]]
+    if cancel.is_set():
+        state["status"] = "cancelled"
+    elif statuses and all(status == "failed" for status in statuses):
+        state["status"] = "failed"
+    else:
+        state["status"] = "done"
+    state["finished"] = time.time()
+    _write_state(state)
+
+
+def get_job(job_id):
+    """
+    Description: Current state of a job. A job that has been asked to stop
+                 but is still winding down reports the status "cancelling".
+
+    Args:
+        job_id (str): ID of the job.
+
+    Returns:
+        dict: The state of the job, None if it does not exist.
+    """
+    state = _read_state(job_id)
+    if state is None:
+        return None
+    if state["status"] not in FINAL_STATES and _cancel_marker(job_id).is_set():
+        state["status"] = "cancelling"
+    return state
+
+
+def cancel_job(job_id):
+    """
+    Description: Asks a job to stop. Queued files are dropped and running
+                 Parsers stop at their next checkpoint.
+
+    Args:
+        job_id (str): ID of the job.
+
+    Returns:
+        dict: The state of the job, None if it does not exist.
+    """
+    state = _read_state(job_id)
+    if state is None:
+        return None
+    if state["status"] not in FINAL_STATES:
+        _cancel_marker(job_id).set()
+    return get_job(job_id)
+
+
+def remove_expired_jobs():
+    """
+    Description: Removes finished jobs older than the PARSER_JOB_RETENTION setting.
+                 A running job rewrites its state at least every second, one whose
+                 state is older than the retention died with its server process
+                 and is removed too.
+    """
+    from django.conf import settings
+
+    retention = getattr(settings, "PARSER_JOB_RETENTION", 3600)
+    if not os.path.isdir(JOBS_PATH):
+        return
+    for job_id in os.listdir(JOBS_PATH):
+        state = _read_state(job_id)
+        if state is None:
+            continue
+        if state["status"] in FINAL_STATES:
+            last_update = state.get("finished", state["created"])
+        else:
+            try:
+                last_update = os.path.getmtime(
+                    os.path.join(job_dir(job_id), "job.json")
+                )
+            except FileNotFoundError:
+                continue
+        if last_update + retention < time.time():
+            shutil.rmtree(job_dir(job_id), ignore_errors=True)
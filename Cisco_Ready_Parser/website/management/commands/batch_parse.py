@@ -0,0 +1,200 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website.file_handler import OUTPUT_FORMATS, parsed_file_name
+from website.threading_handle import threading_for_batch
+from website.views import date_interval_is_valid
+from website.worker_pool import WorkerPool, available_cores
+
+REPORT_EXTENSIONS = (".xlsx", ".xlsb", ".xlsm")
+# Options every output was written with, by output file name. Outputs written with
+# other options are never up to date.
+MANIFEST_NAME = ".batch_parse.json"
+
+
+def is_up_to_date(input_path, output_path):
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except FileNotFoundError:
+        return False
+
+
+def read_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    # a manifest of an older version holds the options of a whole run, not per output
+    return {
+        name: options for name, options in manifest.items() if isinstance(options, dict)
+    }
+
+
+def write_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Parses every Cisco Ready report of a folder on a pool of worker processes. "
+        "Reports whose parsed file is newer than the report and was written with "
+        "the same options are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input_dir", help="Folder with the reports to parse.")
+        parser.add_argument(
+            "--output-dir",
+            help="Folder the parsed files are written to, defaults to input_dir/parsed.",
+        )
+        parser.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--include-minor-items", default="no", choices=["yes", "no"]
+        )
+        parser.add_argument(
+            "--date-target",
+            default="Last Date of Support",
+            choices=[
+                "Last Date of Support",
+                "End of Software Maintenance Date",
+                "End of Product Sale Date",
+                "Last Renewal Date",
+            ],
+        )
+        parser.add_argument(
+            "--date-format",
+            default="DD/MM/YYYY",
+            choices=["DD/MM/YYYY", "MM/DD/YYYY", "YYYY/MM/DD"],
+        )
+        parser.add_argument(
+            "--file-type",
+            default="single customer",
+            choices=["single customer", "multiple customers"],
+        )
+        parser.add_argument("--output-format", default="xlsx", choices=OUTPUT_FORMATS)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Number of worker processes, defaults to the number of available cores.",
+        )
+        parser.add_argument(
+            "--chunk-rows",
+            type=int,
+            default=None,
+            help=(
+                "Rows of a report read and aggregated at a time, for reports that do "
+                "not fit in memory. 0 reads whole reports, defaults to PARSER_CHUNK_ROWS."
+            ),
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Parse reports that are up to date too."
+        )
+
+    def handle(self, *args, **options):
+        input_dir = options["input_dir"]
+        output_dir = options["output_dir"] or os.path.join(input_dir, "parsed")
+        if not os.path.isdir(input_dir):
+            raise CommandError(f"{input_dir} is not a folder")
+        if not date_interval_is_valid(options["start_date"], options["end_date"]):
+            raise CommandError(
+                f"Invalid date interval {options['start_date']} - {options['end_date']}"
+            )
+        os.makedirs(output_dir, exist_ok=True)
+
+        parse_options = {
+            name: options[name]
+            for name in [
+                "start_date",
+                "end_date",
+                "include_minor_items",
+                "date_format",
+                "date_target",
+                "file_type",
+                "output_format",
+            ]
+        }
+        manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        manifest = read_manifest(manifest_path)
+
+        same_dir = os.path.samefile(input_dir, output_dir)
+        jobs = []
+        skipped = 0
+        for file_name in sorted(os.listdir(input_dir)):
+            input_path = os.path.join(input_dir, file_name)
+            if not (
+                os.path.isfile(input_path)
+                and file_name.lower().endswith(REPORT_EXTENSIONS)
+            ):
+                continue
+            name = os.path.splitext(file_name)[0]
+            if same_dir and name.endswith("_parsed"):
+                continue
+            output_name = parsed_file_name(name, options["output_format"])
+            output_path = os.path.join(output_dir, output_name)
+            if (
+                manifest.get(output_name) == parse_options
+                and not options["force"]
+                and is_up_to_date(input_path, output_path)
+            ):
+                skipped += 1
+                continue
+            manifest.pop(output_name, None)
+            jobs.append(
+                (
+                    input_path,
+                    output_path,
+                    options["start_date"],
+                    options["end_date"],
+                    options["include_minor_items"],
+                    options["date_format"],
+                    options["date_target"],
+                    options["file_type"],
+                    options["output_format"],
+                    options["chunk_rows"],
+                )
+            )
+
+        # the outputs about to be rewritten are not trusted any more, even when
+        # this run is interrupted
+        write_manifest(manifest_path, manifest)
+
+        pool = WorkerPool(options["workers"] or available_cores())
+        parsed = failed = rows = 0
+        start = time.time()
+        try:
+            for future in pool.as_completed(threading_for_batch, jobs):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"Failed to parse {error}")
+                    continue
+                parsed += 1
+                rows += result["stats"]["input_rows"]
+                manifest[os.path.basename(result["output"])] = parse_options
+                self.stdout.write(
+                    f"{os.path.basename(result['input'])} parsed in "
+                    f"{result['seconds']:.3f} seconds"
+                )
+        finally:
+            pool.shutdown()
+            write_manifest(manifest_path, manifest)
+        seconds = time.time() - start
+
+        elapsed = seconds or float("inf")
+        self.stdout.write(
+            f"Parsed {parsed} files ({skipped} skipped, {failed} failed), "
+            f"{rows} rows in {seconds:.3f} seconds: "
+            f"{parsed / elapsed:.2f} files/s, {rows / elapsed:.0f} rows/s"
+        )
+        if failed:
+            raise CommandError(f"{failed} files could not be parsed")
@@ -0,0 +1,179 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from functools import partial
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from website.parser import SHEETS, Parser
+from website.synthetic import PORTFOLIO_ENTITIES, generate_report
+
+
+def parser_stages(parser):
+    """
+    Description: The stages of a Parser run, in order, as (name, callable) pairs.
+
+    Args:
+        parser (Parser): A Parser created with run=False.
+
+    Returns:
+        list: The stages of the run.
+    """
+    stages = [
+        ("read", parser.load),
+        ("respect_date_interval", parser._respect_date_interval),
+        ("select_rel_columns", parser._select_rel_columns),
+        ("parse", parser.parse),
+        ("setup_excel", parser._setup_excel),
+    ]
+    for title in SHEETS:
+        stages.append((f"write_{title}", partial(parser.write_to_excel, title)))
+    stages.append(("save_excel", parser._save_excel))
+    return stages
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+class Command(BaseCommand):
+    help = (
+        "Times and memory-profiles every stage of the Parser on synthetic Cisco Ready "
+        "reports of increasing size and appends the results as JSON lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000,1000000",
+            help="Comma separated row counts of the generated reports.",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="Timed runs per size."
+        )
+        parser.add_argument(
+            "--output",
+            default="benchmark_results.jsonl",
+            help="JSON lines file the results are appended to.",
+        )
+        parser.add_argument(
+            "--data-dir",
+            default=os.path.join("media", "benchmarks"),
+            help="Folder the generated reports are kept in between runs.",
+        )
+        parser.add_argument("--customers", type=int, default=1)
+        parser.add_argument("--sites", type=int, default=10)
+        parser.add_argument("--minor-ratio", type=float, default=0.3)
+        parser.add_argument(
+            "--portfolios",
+            default=",".join(PORTFOLIO_ENTITIES),
+            help="Comma separated portfolios the generated items are drawn from.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--start-date", default="2016-01-01")
+        parser.add_argument("--end-date", default="2040-01-01")
+        parser.add_argument(
+            "--include-minor-items", default="no", choices=["yes", "no"]
+        )
+        parser.add_argument("--date-target", default="Last Date of Support")
+        parser.add_argument("--date-format", default="DD/MM/YYYY")
+        parser.add_argument(
+            "--file-type",
+            default="single customer",
+            choices=["single customer", "multiple customers"],
+        )
+
+    def handle(self, *args, **options):
+        os.makedirs(options["data_dir"], exist_ok=True)
+        run = {
+            "run_id": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+        }
+        portfolios = options["portfolios"].split(",")
+        with open(options["output"], "a") as results:
+            for rows in [int(size) for size in options["sizes"].split(",")]:
+                path = os.path.join(
+                    options["data_dir"],
+                    f"report_{rows}_{options['customers']}_{options['seed']}.xlsx",
+                )
+                if not os.path.exists(path):
+                    self.stdout.write(f"Generating {path}")
+                    generate_report(
+                        path,
+                        rows,
+                        customers=options["customers"],
+                        sites=options["sites"],
+                        portfolios=portfolios,
+                        minor_ratio=options["minor_ratio"],
+                        seed=options["seed"],
+                    )
+                for record in self.benchmark(path, rows, options):
+                    record.update(run)
+                    results.write(json.dumps(record) + "\n")
+                    peak = record["peak_bytes"] / 2**20
+                    self.stdout.write(
+                        f"{rows:>9} rows  {record['stage']:<22}"
+                        f"{record['seconds']:>9.3f} s {peak:>9.1f} MiB"
+                    )
+
+    def new_parser(self, path, options):
+        return Parser(
+            path,
+            os.path.join(options["data_dir"], "benchmark_parsed.xlsx"),
+            options["start_date"],
+            options["end_date"],
+            options["include_minor_items"],
+            options["date_format"],
+            options["date_target"],
+            options["file_type"],
+            run=False,
+        )
+
+    def benchmark(self, path, rows, options):
+        timings = {}
+        for _ in range(options["repeat"]):
+            for stage, function in parser_stages(self.new_parser(path, options)):
+                start = time.perf_counter()
+                function()
+                timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+        # memory is measured in a separate run, tracing slows the stages down
+        records = []
+        parser = self.new_parser(path, options)
+        tracemalloc.start()
+        try:
+            for stage, function in parser_stages(parser):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                function()
+                current, peak = tracemalloc.get_traced_memory()
+                records.append(
+                    {
+                        "rows": rows,
+                        "input_bytes": os.path.getsize(path),
+                        "stage": stage,
+                        "seconds": statistics.median(timings[stage]),
+                        "seconds_min": min(timings[stage]),
+                        "repeat": len(timings[stage]),
+                        "peak_bytes": peak - before,
+                        "retained_bytes": current - before,
+                    }
+                )
+        finally:
+            tracemalloc.stop()
+        return records
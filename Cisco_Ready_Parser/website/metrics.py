@@ -0,0 +1,113 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Parses range from a few milliseconds per stage to minutes for the largest reports.
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROWS_BUCKETS = (100, 1000, 10000, 50000, 100000, 250000, 500000, 1000000, 2500000)
+BYTES_BUCKETS = tuple(2**power for power in range(14, 32, 2))
+
+PARSES = Counter(
+    "parser_parses", "Finished parses by outcome.", ["source", "outcome"]
+)
+STAGE_SECONDS = Histogram(
+    "parser_stage_seconds",
+    "Wall time of each Parser stage.",
+    ["stage"],
+    buckets=SECONDS_BUCKETS,
+)
+PARSE_SECONDS = Histogram(
+    "parser_parse_seconds",
+    "Wall time of a whole parse.",
+    ["source"],
+    buckets=SECONDS_BUCKETS,
+)
+INPUT_ROWS = Histogram(
+    "parser_input_rows", "Data rows read per parse.", buckets=ROWS_BUCKETS
+)
+OUTPUT_ROWS = Histogram(
+    "parser_output_rows", "Rows written per parse.", buckets=ROWS_BUCKETS
+)
+INPUT_BYTES = Histogram(
+    "parser_input_bytes", "Size of the parsed reports.", buckets=BYTES_BUCKETS
+)
+OUTPUT_BYTES = Histogram(
+    "parser_output_bytes", "Size of the parsed workbooks.", buckets=BYTES_BUCKETS
+)
+ROWS = Counter("parser_rows", "Rows processed.", ["direction"])
+OUTPUT_CACHE = Counter(
+    "parser_output_cache", "Output cache lookups by result, hit or miss.", ["result"]
+)
+PEAK_MEMORY = Gauge(
+    "parser_peak_memory_bytes",
+    "Largest peak resident memory reported by a parsing process.",
+    multiprocess_mode="max",
+)
+_peak_memory = 0
+
+
+def record_parse(stats, seconds, source):
+    """
+    Description: Records the stats of a finished parse.
+
+    Args:
+        stats (dict): Parser.stats of the parse.
+        seconds (float): Wall time of the whole parse.
+        source (str): Where the parse came from, e.g. single-file, multi-file or job.
+    """
+    global _peak_memory
+    PARSES.labels(source, "done").inc()
+    PARSE_SECONDS.labels(source).observe(seconds)
+    for stage, stage_seconds in stats["stages"].items():
+        STAGE_SECONDS.labels(stage).observe(stage_seconds)
+    if "output_cache" in stats:
+        OUTPUT_CACHE.labels(stats["output_cache"]).inc()
+    # a cached output reads and writes no rows
+    if stats.get("output_cache") != "hit":
+        INPUT_ROWS.observe(stats["input_rows"])
+        OUTPUT_ROWS.observe(stats["output_rows"])
+        ROWS.labels("in").inc(stats["input_rows"])
+        ROWS.labels("out").inc(stats["output_rows"])
+    if stats["input_bytes"] is not None:
+        INPUT_BYTES.observe(stats["input_bytes"])
+    if stats["output_bytes"] is not None:
+        OUTPUT_BYTES.observe(stats["output_bytes"])
+    peak = stats["peak_memory_bytes"]
+    if peak is not None and peak > _peak_memory:
+        _peak_memory = peak
+        PEAK_MEMORY.set(peak)
+
+
+def record_outcome(source, outcome):
+    """
+    Description: Counts a parse that did not finish, e.g. a failed or cancelled one.
+
+    Args:
+        source (str): Where the parse came from.
+        outcome (str): failed or cancelled.
+    """
+    PARSES.labels(source, outcome).inc()
+
+
+def render():
+    """
+    Description: The metrics in the Prometheus text format. When the server runs
+                 several processes, PROMETHEUS_MULTIPROC_DIR must point to a shared
+                 folder and the metrics of all processes are merged.
+
+    Returns:
+        tuple: The exposition and its content type.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,17 +1,345 @@
 import warnings
 
 
-import os.path
+import hashlib
+import json
+import os
 import pathlib
+import shutil
+import sys
+import time
+from contextlib import contextmanager
 
+import numpy as np
 import pandas as pd
-from openpyxl.styles import Font
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from .cache import content_hash
+from .errors import ParseCancelled
+from .reader import (
+    REL_COLS,
+    iter_customer_data,
+    load_customer_data,
+    normalize_dates,
+    read_customer_data,
+    to_excel_serial,
+)
+from .writer import (
+    DATE_FORMATS,
+    ReportWriter,
+    SpreadsheetWriter,
+    TableWriter,
+    assemble_workbook,
+    render_sheet,
+)
 
 warnings.filterwarnings("ignore")
 
+PORTFOLIOS = [
+    "Security",
+    "Collaboration Infrastructure",
+    "Collaboration Endpoints",
+    "Enterprise Routing",
+    "Enterprise Switching",
+    "Compute",
+    "Wireless",
+]
+SHEETS = ["LDoS", "EoSMD", "EoPSD", "LRD"]
+SHEET_DATES = {
+    "LDoS": "Last Date of Support",
+    "EoSMD": "End of Software Maintenance Date",
+    "EoPSD": "End of Product Sale Date",
+    "LRD": "Last Renewal Date",
+}
+# Bump when the content of the outputs changes, so stale cached outputs are ignored.
+OUTPUT_CACHE_VERSION = 1
+
+
+def _input_size(path):
+    if isinstance(path, str):
+        return os.path.getsize(path)
+    return getattr(path, "size", None)
+
+
+def _output_size(output):
+    if isinstance(output, str):
+        return os.path.getsize(output)
+    if hasattr(output, "getbuffer"):
+        return output.getbuffer().nbytes
+    return None
+
+
+def _peak_memory():
+    # peak resident set size of this process, in bytes
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Portfolio of a row by its Business Entity and by its Sub Business Entity.
+# Collaboration rows go to Collaboration Infrastructure unless they are endpoints.
+ENTITY_PORTFOLIOS = {
+    "Security": "Security",
+    "Collaboration": "Collaboration Infrastructure",
+    "Enterprise Routing": "Enterprise Routing",
+    "Enterprise Switching": "Enterprise Switching",
+    "Wireless": "Wireless",
+}
+SUB_ENTITY_PORTFOLIOS = {
+    "TP Endpoints": "Collaboration Endpoints",
+    "UC Endpoints": "Collaboration Endpoints",
+    "Servers": "Compute",
+    "Hyper Converged": "Compute",
+}
+
+
+def _portfolio_codes(series, mapping):
+    """
+    Maps every value of series to the position of its portfolio in PORTFOLIOS, -1 if none.
+    Categorical columns are mapped through their categories only.
+    """
+    codes = {value: PORTFOLIOS.index(portfolio) for value, portfolio in mapping.items()}
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        lookup = [codes.get(value, -1) for value in series.cat.categories]
+        # the trailing -1 is picked up by the -1 code of missing values
+        lookup = np.array(lookup + [-1], dtype=np.int8)
+        return lookup[series.cat.codes.to_numpy()]
+    return series.map(codes).fillna(-1).to_numpy(dtype=np.int8)
+
+
+def _group_key(series):
+    """
+    Integer codes of a categorical column to group on, missing values become NaN
+    so groupby drops them. Categories are sorted, so the codes keep the value order.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes
+        return codes.where(codes >= 0).rename(series.name)
+    return series
+
+
+def aggregate_portfolios(data, selected_date_target, file_type="single customer"):
+    """
+    Description: Sums the item quantities of every portfolio per Product ID and date.
+                 Used both on the classified rows of one report and, as the reduce
+                 step of a consolidation, on the aggregates of several reports.
+
+    Args:
+        data (pd.DataFrame): Rows with a categorical Portfolio column.
+        selected_date_target (str): Date column the rows are grouped and sorted on.
+        file_type (str): single customer or multiple customers.
+
+    Returns:
+        dict: Aggregated table of every portfolio, sorted by the date target.
+    """
+    agg_map = {
+        "Item Quantity": "sum",
+        "Coverage": "first",
+        "Product ID": "first",
+        "Product Description": "first",
+        "Last Date of Support": "first",
+        "End of Product Sale Date": "first",
+        "End of Software Maintenance Date": "first",
+        "Last Renewal Date": "first",
+        "Major/Minor": "first",
+        "Install Site GU Name": "first",
+    }
+    if file_type == "single customer":
+        del agg_map["Install Site GU Name"]
+
+    # one groupby for every portfolio, split per portfolio afterwards
+    keys = [
+        data["Portfolio"].cat.codes.rename("Portfolio"),
+        _group_key(data["Product ID"]),
+        data[selected_date_target],
+    ]
+    aggregated = data.groupby(keys).agg(agg_map)
+    portfolios = aggregated.index.get_level_values("Portfolio")
+    aggregated = aggregated.reset_index(drop=True)
+
+    tables = {}
+    for code, portfolio in enumerate(PORTFOLIOS):
+        table = aggregated[portfolios == code]
+        table = table.sort_values(by=selected_date_target)
+        tables[portfolio] = table[table[selected_date_target].notnull()]
+    return tables
+
+
+def merge_portfolio_tables(partials, selected_date_target, file_type="single customer"):
+    """
+    Description: Reduces the per-portfolio aggregates of several reports into one set
+                 of aggregates, as if the reports had been parsed together. Values
+                 other than the quantity are taken from the first report that has
+                 the Product ID and date, so partials must be given in report order.
+                 Also merges the aggregates of the chunks of one report.
+
+    Args:
+        partials (list): Parser.tables of every report, in report order.
+        selected_date_target (str): Date column the reports were aggregated on.
+        file_type (str): single customer or multiple customers.
+
+    Returns:
+        dict: Aggregated table of every portfolio, sorted by the date target.
+    """
+    frames = []
+    for tables in partials:
+        for portfolio in PORTFOLIOS:
+            table = tables[portfolio]
+            if not table.empty:
+                frames.append(
+                    table.assign(
+                        Portfolio=pd.Categorical([portfolio] * len(table), PORTFOLIOS)
+                    )
+                )
+    if not frames:
+        return {portfolio: partials[0][portfolio] for portfolio in PORTFOLIOS}
+    data = pd.concat(frames, ignore_index=True)
+    # each report has its own categories, so the concatenated column holds the
+    # original values, numbers included. Regrouped on categories sorted like the
+    # reader sorts the Product IDs of a whole report.
+    data["Product ID"] = data["Product ID"].astype("category")
+    return aggregate_portfolios(data, selected_date_target, file_type)
+
+
+def _sort_order(values, previous):
+    """
+    Positions that sort values like DataFrame.sort_values does (quicksort, missing
+    values last), starting from the row order given by previous.
+    """
+    values = values[previous]
+    missing = np.isnat(values)
+    valid = np.flatnonzero(~missing)
+    order = valid[np.argsort(values[valid].view("i8"), kind="quicksort")]
+    return previous[np.concatenate([order, np.flatnonzero(missing)])]
+
+
+def _sheet_orders(df):
+    """
+    Row positions of a result table for every sheet. LDoS keeps the order of the
+    table. The other sheets are sorted on their date in SHEETS order, each starting
+    from the order of the previous sheet, as the tables used to be sorted in place.
+    """
+    previous = np.arange(len(df))
+    orders = {"LDoS": previous}
+    for title in SHEETS[1:]:
+        values = df[SHEET_DATES[title]].to_numpy(dtype="datetime64[ns]")
+        previous = orders[title] = _sort_order(values, previous)
+    return orders
+
+
+def _column_values(series, order):
+    """The values of a column in the given row order, missing values as None."""
+    values = series.to_numpy(dtype=object)[order]
+    values[pd.isna(values)] = None
+    return values
+
+
+def sheet_columns(title, file_type):
+    """
+    Description: Columns of the result tables shown on one sheet of the report.
+
+    Args:
+        title (str): One of SHEETS.
+        file_type (str): single customer or multiple customers.
+
+    Returns:
+        tuple: The columns in sheet order, and the date column of the sheet.
+    """
+    cols_to_keep = [
+        "Item Quantity",
+        "Coverage",
+        "Product ID",
+        "Product Description",
+        "End of Product Sale Date",
+        "Last Renewal Date",
+        "End of Software Maintenance Date",
+        "Last Date of Support",
+        "Major/Minor",
+        "Install Site GU Name",
+    ]
+    if title == "LDoS":
+        cols_to_keep.remove("Last Renewal Date")
+        cols_to_keep.remove("End of Product Sale Date")
+        cols_to_keep.remove("End of Software Maintenance Date")
+        interest = "Last Date of Support"
+    elif title == "LRD":
+        cols_to_keep.remove("End of Product Sale Date")
+        cols_to_keep.remove("End of Software Maintenance Date")
+        cols_to_keep.remove("Last Date of Support")
+        interest = "Last Renewal Date"
+
+    elif title == "EoPSD":
+        cols_to_keep.remove("Last Renewal Date")
+        cols_to_keep.remove("Last Date of Support")
+        cols_to_keep.remove("End of Software Maintenance Date")
+        interest = "End of Product Sale Date"
+    elif title == "EoSMD":
+        cols_to_keep.remove("Last Renewal Date")
+        cols_to_keep.remove("End of Product Sale Date")
+        cols_to_keep.remove("Last Date of Support")
+        interest = "End of Software Maintenance Date"
+    if file_type == "single customer":
+        cols_to_keep.remove("Install Site GU Name")
+    return cols_to_keep, interest
+
+
+def sheet_layout(result, orders, title, file_type, output_date_format):
+    """
+    Description: Header, rows and number formats of one sheet of the report.
+
+    Args:
+        result (list): Parser.result, (table, portfolio) pairs.
+        orders (list): Row positions of every table for each sheet, see _sheet_orders.
+        title (str): One of SHEETS.
+        file_type (str): single customer or multiple customers.
+        output_date_format (str): Format of the dates in the workbook.
+
+    Returns:
+        tuple: header, blocks and number_formats, see ReportWriter.add_sheet.
+    """
+    cols_to_keep, interest = sheet_columns(title, file_type)
+    columns = [
+        "Quantity",
+        "Coverage",
+        "Product ID",
+        "Product Description",
+        interest,
+        "Major/Minor",
+    ]
+
+    if file_type == "multiple customers":
+        columns.append("Install Site GU Name")
+
+    blocks = []
+    for (df, category), sheet_orders in zip(result, orders):
+        order = sheet_orders[title]
+        values = [_column_values(df[name], order) for name in cols_to_keep]
+        blocks.append((category, values))
+
+    # dates are written as date cells, shown in the chosen format
+    number_formats = {columns.index(interest): DATE_FORMATS[output_date_format]}
+    return columns, blocks, number_formats
+
+
+def render_report_sheet(result, orders, title, file_type, output_date_format):
+    """
+    Description: Renders the XML of one sheet of the report, runs in a worker of the
+                 sheet pool so the sheets of a report are rendered side by side.
+                 See sheet_layout for the arguments and writer.render_sheet for the result.
+    """
+    return render_sheet(
+        *sheet_layout(result, orders, title, file_type, output_date_format)
+    )
+
 
 class Parser:
     DIR = f"{str(pathlib.Path().resolve())}"
+    # Smaller reports are rendered faster than their tables are sent to the sheet pool.
+    PARALLEL_SHEET_ROWS = 20000
 
     def __init__(
         self,
@@ -23,147 +351,364 @@ class Parser:
         output_date_format,
         selected_date_target,
         file_type="single customer",
+        reader="streaming",
+        writer="streaming",
+        write_only=False,
+        cancel_event=None,
+        input_cache=None,
+        output_format="xlsx",
+        chunk_rows=None,
+        output_cache=None,
+        progress=None,
+        sheet_pool=None,
+        run=True,
     ):
-        self.customer_data = pd.read_excel(
-            path,
-            skiprows=3,
-        )
+        self.path = path
         self._start_date = start_date
         self._end_date = end_date
         self.include_minor_items = include_minor_items
         self.selected_date_target = selected_date_target
         self.output_date_format = output_date_format
         self.file_type = file_type
+        self.reader = reader
+        self.writer = writer
+        self.write_only = write_only
+        self.output_format = output_format
+        self.cancel_event = cancel_event
+        self.progress = progress
+        self.sheet_pool = sheet_pool
+        self.input_cache = input_cache
+        self.output_cache = output_cache
+        self.chunk_rows = chunk_rows
+        if chunk_rows and reader != "streaming":
+            raise ValueError("chunk_rows needs the streaming reader")
 
         self.result = []
-        self.output = f"{self.DIR}/{output}"
-
-        self._respect_date_interval()
-        self._select_rel_columns()
-
-        self.parse()
+        self.orders = None
+        self.tables = None
+        self._digest = None
+        self.stats = {
+            "stages": {},
+            "input_rows": 0,
+            "output_rows": 0,
+            "input_bytes": _input_size(path),
+            "output_bytes": None,
+            "peak_memory_bytes": None,
+        }
+        if isinstance(output, str):
+            self.output = os.path.join(self.DIR, output)
+        else:
+            # a writable binary file object, e.g. an in-memory buffer
+            self.output = output
+
+        if run:
+            self.run()
+
+    def run(self):
+        if self.output_cache is not None and self._copy_cached_output():
+            return
+        self._report("reading")
+        if self.chunk_rows:
+            self.parse_chunks()
+        else:
+            self.load()
+            self._report("aggregating", input_rows=self.stats["input_rows"])
+
+            self._check_cancelled()
+            self._respect_date_interval()
+            self._select_rel_columns()
+
+            self._check_cancelled()
+            self.parse()
+
+        self.write()
+        self.stats["output_bytes"] = _output_size(self.output)
+        self.stats["peak_memory_bytes"] = _peak_memory()
+        if self.output_cache is not None:
+            self._store_output()
+
+    def _report(self, stage, **info):
+        # tells the progress callback, if any, which stage the parse is in
+        if self.progress is not None:
+            self.progress(stage, **info)
+
+    def _input_digest(self):
+        # content hash of the report, shared by the input and output caches
+        if self._digest is None:
+            self._digest = content_hash(self.path)
+        return self._digest
+
+    def _output_key(self):
+        """
+        Key of the output in the output cache: the content of the report plus every
+        option that changes the output. The reader, the writer mode and the chunk
+        size give identical outputs, so they are left out.
+        """
+        options = [
+            self._start_date,
+            self._end_date,
+            self.selected_date_target,
+            self.include_minor_items,
+            self.output_date_format,
+            self.file_type,
+            self.output_format,
+        ]
+        digest = hashlib.sha256(json.dumps(options, default=str).encode()).hexdigest()
+        return f"{self._input_digest()}-{digest[:16]}-v{OUTPUT_CACHE_VERSION}"
+
+    def _copy_cached_output(self):
+        """
+        Writes the cached output of an identical earlier parse, if there is one.
+        Nothing is parsed then, so the stats hold no rows and there are no tables.
+        """
+        with self._stage("output_cache"):
+            entry = self.output_cache.get(self._output_key())
+            if entry is None:
+                self.stats["output_cache"] = "miss"
+                return False
+            with open(entry, "rb") as source:
+                if isinstance(self.output, str):
+                    with open(self.output, "wb") as target:
+                        shutil.copyfileobj(source, target)
+                else:
+                    shutil.copyfileobj(source, self.output)
+        self.stats["output_cache"] = "hit"
+        self.stats["output_bytes"] = _output_size(self.output)
+        self.stats["peak_memory_bytes"] = _peak_memory()
+        return True
+
+    def _store_output(self):
+        def write(path):
+            if isinstance(self.output, str):
+                shutil.copyfile(self.output, path)
+            else:
+                with open(path, "wb") as f:
+                    f.write(self.output.getbuffer())
+
+        if not (isinstance(self.output, str) or hasattr(self.output, "getbuffer")):
+            return
+        with self._stage("output_cache"):
+            try:
+                self.output_cache.put(self._output_key(), write)
+            except OSError as error:
+                # e.g. a full disk, the parse itself succeeded
+                print(f"Could not cache output: {error}")
+
+    @contextmanager
+    def _stage(self, name):
+        # adds the wall time of the block to self.stats["stages"][name]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages = self.stats["stages"]
+            stages[name] = stages.get(name, 0) + time.perf_counter() - start
+
+    def load(self):
+        self._check_cancelled()
+        with self._stage("load"):
+            reader_stats = {}
+            if self.reader == "streaming" and self.input_cache is not None:
+                self.customer_data = load_customer_data(
+                    self.path,
+                    self.input_cache,
+                    checkpoint=self._check_cancelled,
+                    digest=self._input_digest(),
+                )
+            elif self.reader == "streaming":
+                self.customer_data = read_customer_data(
+                    self.path,
+                    self._start_date,
+                    self._end_date,
+                    self.selected_date_target,
+                    self.include_minor_items,
+                    checkpoint=self._check_cancelled,
+                    stats=reader_stats,
+                )
+            else:
+                self.customer_data = pd.read_excel(
+                    self.path,
+                    skiprows=3,
+                )
+            self.stats["input_rows"] = reader_stats.get(
+                "rows_read", len(self.customer_data)
+            )
 
+    def write(self):
+        if (
+            self.sheet_pool is not None
+            and self.output_format == "xlsx"
+            and self.writer == "streaming"
+            and self.stats["output_rows"] >= self.PARALLEL_SHEET_ROWS
+        ):
+            self._write_sheets_in_parallel()
+            return
         self._setup_excel()
-        self.write_to_excel("LDoS")
-        self.write_to_excel("EoSMD")
-        self.write_to_excel("EoPSD")
-        self.write_to_excel("LRD")
+        for sheet, title in enumerate(SHEETS, 1):
+            self._check_cancelled()
+            self._report(
+                "writing",
+                sheet=sheet,
+                sheets=len(SHEETS),
+                input_rows=self.stats["input_rows"],
+                output_rows=self.stats["output_rows"],
+            )
+            self.write_to_excel(title)
+        self._save_excel()
+
+    def _write_sheets_in_parallel(self):
+        """
+        Renders every sheet in a worker of sheet_pool at the same time, then puts the
+        sheets together into the same workbook as write would. Each worker is sent
+        only the columns and the row order of its own sheet. The write stage of a
+        sheet is the time until it came back from its worker.
+        """
+        self._check_cancelled()
+        orders = self._sort_orders()
+        start = time.perf_counter()
+        futures = []
+        for title in SHEETS:
+            columns, _ = sheet_columns(title, self.file_type)
+            futures.append(
+                self.sheet_pool.submit(
+                    render_report_sheet,
+                    [(df[columns], category) for df, category in self.result],
+                    [{title: sheet_orders[title]} for sheet_orders in orders],
+                    title,
+                    self.file_type,
+                    self.output_date_format,
+                )
+            )
+        parts = []
+        for sheet, (title, future) in enumerate(zip(SHEETS, futures), 1):
+            self._report(
+                "writing",
+                sheet=sheet,
+                sheets=len(SHEETS),
+                input_rows=self.stats["input_rows"],
+                output_rows=self.stats["output_rows"],
+            )
+            parts.append(future.result())
+            self.stats["stages"][f"write_{title}"] = time.perf_counter() - start
+        with self._stage("save"):
+            # the number formats do not depend on the rows
+            _, _, number_formats = sheet_layout(
+                [], [], SHEETS[0], self.file_type, self.output_date_format
+            )
+            assemble_workbook(self.output, SHEETS, parts, number_formats)
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ParseCancelled()
 
     def _respect_date_interval(self):
-        date_time_cols = [
-            "Last Date of Support",
-            "End of Product Sale Date",
-            "End of Software Maintenance Date",
-            "Last Renewal Date",
-        ]
-        for name in date_time_cols:
-            self.customer_data[name] = pd.to_datetime(
-                pd.to_numeric(self.customer_data[name]),
-                origin="1899-12-30",
-                unit="D",
-            )
-        # probably add some try except
-        lower = self.customer_data[self.selected_date_target] > self._start_date
-        upper = self.customer_data[self.selected_date_target] < self._end_date
-        self.customer_data = self.customer_data[lower & upper]
+        with self._stage("filtering"):
+            target = self.customer_data[self.selected_date_target]
+            if pd.api.types.is_datetime64_any_dtype(target):
+                lower = pd.Timestamp(self._start_date)
+                upper = pd.Timestamp(self._end_date)
+            else:
+                # raw Excel serials, compared against the bounds as serials so
+                # only the rows inside the window are converted to datetimes
+                target = pd.to_numeric(target)
+                lower = to_excel_serial(self._start_date)
+                upper = to_excel_serial(self._end_date)
+            self.customer_data = self.customer_data[(target > lower) & (target < upper)]
+        with self._stage("date_conversion"):
+            normalize_dates(self.customer_data)
 
     def parse(self):
-        portfolio_lst = [
-            "Security",
-            "Collaboration Infrastructure",
-            "Collaboration Endpoints",
-            "Enterprise Routing",
-            "Enterprise Switching",
-            "Compute",
-            "Wireless",
-        ]
+        with self._stage("aggregation"):
+            self._classify_portfolios()
+            self._set_tables(self._aggregate_portfolios())
+
+    def parse_chunks(self):
+        """
+        Description: Reads and aggregates the report chunk_rows rows at a time instead
+                     of loading it whole. Only the running aggregates of every portfolio
+                     are kept between chunks, so memory depends on the chunk size and
+                     the number of Product ID and date groups, not on the report size.
+                     The input cache is not used, it holds whole reports.
+        """
+        reader_stats = {}
+        chunks = iter_customer_data(
+            self.path,
+            self._start_date,
+            self._end_date,
+            self.selected_date_target,
+            self.include_minor_items,
+            chunk_rows=self.chunk_rows,
+            checkpoint=self._check_cancelled,
+            stats=reader_stats,
+        )
+        tables = None
+        count = 0
+        while True:
+            self._check_cancelled()
+            with self._stage("load"):
+                self.customer_data = next(chunks, None)
+            if self.customer_data is None:
+                break
+            count += 1
+            self._report("aggregating", chunks=count)
+            self._respect_date_interval()
+            self._select_rel_columns()
+            with self._stage("aggregation"):
+                self._classify_portfolios()
+                partial = self._aggregate_portfolios()
+                if tables is not None:
+                    # earlier chunks first, their values win like earlier rows do
+                    partial = merge_portfolio_tables(
+                        [tables, partial], self.selected_date_target, self.file_type
+                    )
+                tables = partial
+        self.customer_data = None
+        self.stats["input_rows"] = reader_stats["rows_read"]
+        self._set_tables(tables)
+
+    def _set_tables(self, tables):
+        self.tables = tables
         self.result.append(self.build_for_management())
-        for portfolio in portfolio_lst:
-            self.result.append(self.build_portfolio(portfolio))
+        for portfolio in PORTFOLIOS:
+            self.result.append((tables[portfolio], portfolio))
+        self.stats["output_rows"] = sum(len(df) for df, _ in self.result)
 
     def _select_rel_columns(self):
-        rel_cols = [
-            "Item Quantity",
-            "Coverage",
-            "Product ID",
-            "Product Description",
-            "End of Product Sale Date",
-            "Last Renewal Date",
-            "End of Software Maintenance Date",
-            "Last Date of Support",
-            "Business Entity",
-            "Sub Business Entity",
-            "Product Type",
-            "Major/Minor",
-            "Install Site GU Name",
-        ]
-        self.customer_data = self.customer_data[rel_cols]
-        if self.include_minor_items == "no":
-            self.customer_data = self.customer_data[
-                self.customer_data["Major/Minor"] == "Major"
-            ]
-
-    def _grab_portfolio(self, portfolio):
-        if portfolio == "Collaboration Endpoints":
-            portfolio_df = self.customer_data.loc[
-                self.customer_data["Sub Business Entity"].isin(
-                    ["TP Endpoints", "UC Endpoints"]
-                )
-            ]
-        elif portfolio == "Collaboration Infrastructure":
-            portfolio_df = self.customer_data.loc[
-                self.customer_data["Business Entity"] == "Collaboration"
-            ]
-            portfolio_df = portfolio_df.loc[
-                ~portfolio_df["Sub Business Entity"].isin(
-                    ["TP Endpoints", "UC Endpoints"]
-                )
-            ]
-        elif portfolio == "Compute":
-            portfolio_df = self.customer_data.loc[
-                self.customer_data["Sub Business Entity"].isin(
-                    ["Servers", "Hyper Converged"]
-                )
-            ]
-        else:
-            portfolio_df = self.customer_data.loc[
-                self.customer_data["Business Entity"] == portfolio
-            ]
-        return portfolio_df
-
-    def build_portfolio(self, portfolio):
-        df_filter = ["Product ID", self.selected_date_target]  # "Last Date of Support"]
-        portfolio_df = self._grab_portfolio(portfolio)
-        agg_map = {
-            "Item Quantity": "sum",
-            "Coverage": "first",
-            "Product ID": "first",
-            "Product Description": "first",
-            "Last Date of Support": "first",
-            "End of Product Sale Date": "first",
-            "End of Software Maintenance Date": "first",
-            "Last Renewal Date": "first",
-            "Business Entity": "first",
-            "Sub Business Entity": "first",
-            "Product Type": "first",
-            "Major/Minor": "first",
-            "Install Site GU Name": "first",
-        }
-
-        count_duplicates = (
-            portfolio_df.groupby(df_filter).agg(agg_map).reset_index(drop=True)
+        with self._stage("filtering"):
+            self.customer_data = self.customer_data[REL_COLS]
+            if self.include_minor_items == "no":
+                self.customer_data = self.customer_data[
+                    self.customer_data["Major/Minor"] == "Major"
+                ]
+
+    def _classify_portfolios(self):
+        data = self.customer_data
+        entity = _portfolio_codes(data["Business Entity"], ENTITY_PORTFOLIOS)
+        sub_entity = _portfolio_codes(data["Sub Business Entity"], SUB_ENTITY_PORTFOLIOS)
+        collaboration = PORTFOLIOS.index("Collaboration Infrastructure")
+        endpoints = PORTFOLIOS.index("Collaboration Endpoints")
+        entity[(entity == collaboration) & (sub_entity == endpoints)] = -1
+
+        # a row matching a portfolio on both entity columns belongs to both,
+        # so it is repeated right after itself for the sub business entity
+        # portfolio. Rows stay in report order, which decides the "first" values
+        # of the aggregation.
+        portfolio = np.where(entity >= 0, entity, sub_entity)
+        both = (entity >= 0) & (sub_entity >= 0)
+        positions = np.flatnonzero(portfolio >= 0)
+        codes = portfolio[positions]
+        if both.any():
+            positions = np.concatenate([positions, np.flatnonzero(both)])
+            codes = np.concatenate([codes, sub_entity[both]])
+            order = np.argsort(positions, kind="stable")
+            positions, codes = positions[order], codes[order]
+        self.customer_data = data.iloc[positions].assign(
+            Portfolio=pd.Categorical.from_codes(codes, PORTFOLIOS)
         )
-        count_duplicates.drop(
-            columns=["Business Entity", "Sub Business Entity", "Product Type"],
-            inplace=True,
-        )
-        if self.file_type == "single customer":
-            count_duplicates.drop(columns=["Install Site GU Name"], inplace=True)
 
-        count_duplicates.sort_values(by=self.selected_date_target, inplace=True)
-        return (
-            count_duplicates[count_duplicates[self.selected_date_target].notnull()],
-            portfolio,
+    def _aggregate_portfolios(self):
+        return aggregate_portfolios(
+            self.customer_data, self.selected_date_target, self.file_type
         )
 
     def build_for_management(self):
@@ -188,118 +733,85 @@ class Parser:
         return (empty_df, "Management Software")
 
     def _setup_excel(self):
-        if not os.path.isfile(self.output):
-            writer = pd.ExcelWriter(self.output, engine="openpyxl")
-            pd.DataFrame().to_excel(writer, sheet_name="LDoS", index=False)
-            pd.DataFrame().to_excel(writer, sheet_name="EoSMD", index=False)
-            pd.DataFrame().to_excel(writer, sheet_name="EoPSD", index=False)
-            pd.DataFrame().to_excel(writer, sheet_name="LRD", index=False)
-            writer.save()
-
-    def write_to_excel(self, title):
-        writer = pd.ExcelWriter(
-            self.output, engine="openpyxl", mode="a", if_sheet_exists="overlay"
-        )
-
-        worksheet = writer.sheets[title]
-
-        worksheet.column_dimensions["A"].width = 15
-        worksheet.column_dimensions["B"].width = 12.5
-        worksheet.column_dimensions["C"].width = 20
-        worksheet.column_dimensions["D"].width = 59
-        worksheet.column_dimensions["E"].width = 28
-        worksheet.column_dimensions["F"].width = 15
-        worksheet.column_dimensions["G"].width = 20
-        cols_to_keep = [
-            "Item Quantity",
-            "Coverage",
-            "Product ID",
-            "Product Description",
-            "End of Product Sale Date",
-            "Last Renewal Date",
-            "End of Software Maintenance Date",
-            "Last Date of Support",
-            "Major/Minor",
-            "Install Site GU Name",
-        ]
-        if title == "LDoS":
-            cols_to_keep.remove("Last Renewal Date")
-            cols_to_keep.remove("End of Product Sale Date")
-            cols_to_keep.remove("End of Software Maintenance Date")
-            interest = "Last Date of Support"
-        elif title == "LRD":
-            cols_to_keep.remove("End of Product Sale Date")
-            cols_to_keep.remove("End of Software Maintenance Date")
-            cols_to_keep.remove("Last Date of Support")
-            for df in self.result:
-                df[0].sort_values(by="Last Renewal Date", inplace=True)
-            interest = "Last Renewal Date"
-
-        elif title == "EoPSD":
-            cols_to_keep.remove("Last Renewal Date")
-            cols_to_keep.remove("Last Date of Support")
-            cols_to_keep.remove("End of Software Maintenance Date")
-            for df in self.result:
-                df[0].sort_values(by="End of Product Sale Date", inplace=True)
-            interest = "End of Product Sale Date"
-        elif title == "EoSMD":
-            cols_to_keep.remove("Last Renewal Date")
-            cols_to_keep.remove("End of Product Sale Date")
-            cols_to_keep.remove("Last Date of Support")
-            for df in self.result:
-                df[0].sort_values(by="End of Software Maintenance Date", inplace=True)
-            interest = "End of Software Maintenance Date"
-        if self.file_type == "single customer":
-            cols_to_keep.remove("Install Site GU Name")
-
-        columns = [
-            "Quantity",
-            "Coverage",
-            "Product ID",
-            "Product Description",
-            interest,
-            "Major/Minor",
-        ]
-
-        if self.file_type == "multiple customers":
-            columns.append("Install Site GU Name")
-
-        col_idx = 1
-        for col in columns:
-            worksheet.cell(row=1, column=col_idx).value = col
-            col_idx += 1
-
-        row_num = 2
-
-        bold_font = Font(bold=True)
-
+        if self.output_format == "xlsx" and self.writer == "streaming":
+            self._writer = SpreadsheetWriter(self.output)
+        elif self.output_format == "xlsx":
+            # write_only only applies to the openpyxl writer
+            self._writer = ReportWriter(self.output, write_only=self.write_only)
+        else:
+            # the data only, no workbook is built at all
+            self._writer = TableWriter(
+                self.output, self.output_format, self.output_date_format
+            )
 
-        #  count_duplicates[count_duplicates[self.selected_date_target].notnull()],
-        #     portfolio,
+    def _save_excel(self):
+        with self._stage("save"):
+            self._writer.save()
 
-        for df_category in self.result:
-            df = df_category[0][cols_to_keep] #grabs the df and filters on it
-            try:
-                # nice case when df is empty
-                if self.output_date_format == "DD/MM/YYYY":
-                    df[interest] = df[interest].dt.strftime("%d/%m/%Y")
-                elif self.output_date_format == "MM/DD/YYYY":
-                    df[interest] = df[interest].dt.strftime("%m/%d/%Y")    
-                else:
-                    df[interest] = df[interest].dt.strftime("%Y/%m/%d")
-            except:
-                pass
-
-            #skip category is no data
-            if df.empty:
-                continue
-
-            category = df_category[1] #grabs the category
-            worksheet.cell(row=row_num, column=1).value = category
-            worksheet.cell(row=row_num, column=1).font = bold_font
-            df.to_excel(
-                writer, sheet_name=title, startrow=row_num, index=False, header=None
-            )
-            row_num += df.shape[0] + 2
+    def _sort_orders(self):
+        """
+        Row positions of every result table for each sheet, computed once and
+        reused by every sheet instead of re-sorting the tables in place.
+        """
+        if self.orders is None:
+            self.orders = [_sheet_orders(df) for df, _ in self.result]
+        return self.orders
 
-        writer.save()
+    def write_to_excel(self, title):
+        header, blocks, number_formats = sheet_layout(
+            self.result,
+            self._sort_orders(),
+            title,
+            self.file_type,
+            self.output_date_format,
+        )
+        with self._stage(f"write_{title}"):
+            self._writer.add_sheet(title, header, blocks, number_formats)
+
+
+def write_consolidated_report(
+    partials,
+    output,
+    output_date_format,
+    selected_date_target,
+    write_only=False,
+    output_format="xlsx",
+    writer="streaming",
+    sheet_pool=None,
+):
+    """
+    Description: Writes one workbook for several reports from their aggregates,
+                 without reading the reports again.
+
+    Args:
+        partials (list): Parser.tables of every report, in report order.
+        output (str|file): Path or writable binary file object the workbook is written to.
+        output_date_format (str): Format of the dates in the workbook.
+        selected_date_target (str): Date column the reports were aggregated on.
+        write_only (bool): Use openpyxl's write-only mode, with the openpyxl writer.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        writer (str): streaming writes the workbook with SpreadsheetWriter, openpyxl
+                      with ReportWriter.
+        sheet_pool (WorkerPool): Optional pool the sheets of a large workbook are
+                                 rendered on in parallel.
+
+    Returns:
+        Parser: The Parser that wrote the workbook, with its stats.
+    """
+    parser = Parser(
+        None,
+        output,
+        None,
+        None,
+        None,
+        output_date_format,
+        selected_date_target,
+        writer=writer,
+        write_only=write_only,
+        output_format=output_format,
+        sheet_pool=sheet_pool,
+        run=False,
+    )
+    parser._set_tables(merge_portfolio_tables(partials, selected_date_target))
+    parser.write()
+    return parser
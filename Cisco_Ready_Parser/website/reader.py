@@ -0,0 +1,336 @@
+import datetime
+import zipfile
+
+import pandas as pd
+
+from .cache import content_hash
+
+REL_COLS = [
+    "Item Quantity",
+    "Coverage",
+    "Product ID",
+    "Product Description",
+    "End of Product Sale Date",
+    "Last Renewal Date",
+    "End of Software Maintenance Date",
+    "Last Date of Support",
+    "Business Entity",
+    "Sub Business Entity",
+    "Product Type",
+    "Major/Minor",
+    "Install Site GU Name",
+]
+
+# Low-cardinality text columns, stored as categoricals to keep the frame compact.
+CATEGORY_COLS = [
+    "Coverage",
+    "Product ID",
+    "Product Description",
+    "Business Entity",
+    "Sub Business Entity",
+    "Product Type",
+    "Major/Minor",
+    "Install Site GU Name",
+]
+
+DATE_COLS = [
+    "Last Date of Support",
+    "End of Product Sale Date",
+    "End of Software Maintenance Date",
+    "Last Renewal Date",
+]
+
+# Cisco Ready exports have three banner rows above the header row.
+HEADER_ROW = 3
+CHECKPOINT_ROWS = 10000
+# Bump when the layout of the normalized data changes, so stale cache entries are ignored.
+CACHE_VERSION = 3
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+
+def to_excel_serial(value):
+    """
+    Description: Converts a date into the Excel serial number used by the raw report cells.
+
+    Args:
+        value (str|datetime.date): Date to convert, strings are expected as YYYY-MM-DD.
+
+    Returns:
+        float: Number of days since the Excel epoch (1899-12-30).
+    """
+    # Plain datetimes, a pandas Timedelta cannot span the ~300 years up to 2200.
+    timestamp = pd.Timestamp(value).to_pydatetime()
+    return (timestamp - EXCEL_EPOCH) / datetime.timedelta(days=1)
+
+
+def _to_serial(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return (value - EXCEL_EPOCH) / datetime.timedelta(days=1)
+    if isinstance(value, datetime.date):
+        return float((value - EXCEL_EPOCH.date()).days)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_xlsb(path):
+    """
+    Description: Checks whether a workbook is in the binary .xlsb format.
+                 Uploaded files are not always saved with an extension, so
+                 this looks at the archive content rather than the name.
+
+    Args:
+        path (str|file): Path or binary file object of the workbook.
+
+    Returns:
+        bool: True if the workbook is an .xlsb file.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return "xl/workbook.bin" in archive.namelist()
+    except zipfile.BadZipFile:
+        return False
+    finally:
+        if hasattr(path, "seek"):
+            path.seek(0)
+
+
+def iter_rows(path):
+    """
+    Description: Streams the raw cell values of the first sheet row by row.
+
+    Args:
+        path (str|file): Path or binary file object of the workbook.
+
+    Yields:
+        list: The values of one row.
+    """
+    if is_xlsb(path):
+        from pyxlsb import open_workbook
+
+        with open_workbook(path) as workbook:
+            with workbook.get_sheet(1) as sheet:
+                for row in sheet.rows():
+                    yield [cell.v for cell in row]
+    else:
+        from openpyxl import load_workbook
+
+        # openpyxl rejects paths without an xlsx extension, uploads are saved
+        # without one, so it is always handed an open file
+        source = open(path, "rb") if isinstance(path, str) else path
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            workbook.close()
+            if source is not path:
+                source.close()
+
+
+def read_customer_data(
+    path,
+    start_date=None,
+    end_date=None,
+    selected_date_target=None,
+    include_minor_items="yes",
+    checkpoint=None,
+    stats=None,
+):
+    """
+    Description: Streams a Cisco Ready report and keeps only the columns in REL_COLS.
+                 The Major/Minor and date window filters are applied while reading,
+                 so only surviving rows are ever put into the DataFrame.
+                 Date columns are returned as raw Excel serial numbers.
+
+    Args:
+        path (str|file): Path or binary file object of the report.
+        start_date (str): Lower end of the date filter, exclusive. None disables the filter.
+        end_date (str): Higher end of the date filter, exclusive. None disables the filter.
+        selected_date_target (str): Date column the date filter is applied to.
+        include_minor_items (str): yes/no value that decides whether we include Minor items.
+        checkpoint (callable): Called every CHECKPOINT_ROWS rows, may raise to abort the read.
+        stats (dict): Optional, receives the number of data rows read as "rows_read".
+
+    Returns:
+        pandas.DataFrame: The projected and filtered customer data, see compact_dtypes.
+    """
+    chunks = iter_customer_data(
+        path,
+        start_date,
+        end_date,
+        selected_date_target,
+        include_minor_items,
+        checkpoint=checkpoint,
+        stats=stats,
+    )
+    return next(chunks)
+
+
+def iter_customer_data(
+    path,
+    start_date=None,
+    end_date=None,
+    selected_date_target=None,
+    include_minor_items="yes",
+    chunk_rows=None,
+    checkpoint=None,
+    stats=None,
+):
+    """
+    Description: Same as read_customer_data, but yields the surviving rows in frames
+                 of at most chunk_rows rows, so a report never has to be held in
+                 memory as a whole. Every frame has its own categories.
+
+    Args:
+        path (str|file): Path or binary file object of the report.
+        start_date (str): Lower end of the date filter, exclusive. None disables the filter.
+        end_date (str): Higher end of the date filter, exclusive. None disables the filter.
+        selected_date_target (str): Date column the date filter is applied to.
+        include_minor_items (str): yes/no value that decides whether we include Minor items.
+        chunk_rows (int): Number of rows per frame, None yields a single frame.
+        checkpoint (callable): Called every CHECKPOINT_ROWS rows, may raise to abort the read.
+        stats (dict): Optional, receives the number of data rows read as "rows_read".
+
+    Yields:
+        pandas.DataFrame: The next rows of the customer data, see compact_dtypes.
+                          At least one, possibly empty, frame is yielded.
+    """
+    rows = iter_rows(path)
+    for _ in range(HEADER_ROW):
+        next(rows, None)
+    header = next(rows, None) or []
+    positions = {name: idx for idx, name in enumerate(header) if name in REL_COLS}
+    missing = [name for name in REL_COLS if name not in positions]
+    if missing:
+        raise KeyError(f"Columns not found in the report: {missing}")
+
+    lower = to_excel_serial(start_date) if start_date is not None else None
+    upper = to_excel_serial(end_date) if end_date is not None else None
+    target_idx = positions[selected_date_target] if selected_date_target else None
+    minor_idx = positions["Major/Minor"]
+    date_idx = [REL_COLS.index(name) for name in DATE_COLS]
+    col_idx = [positions[name] for name in REL_COLS]
+    width = max(col_idx) + 1
+
+    columns = [[] for _ in REL_COLS]
+    kept = 0
+    yielded = False
+    count = 0
+    for count, row in enumerate(rows, 1):
+        if checkpoint is not None and count % CHECKPOINT_ROWS == 0:
+            checkpoint()
+        if len(row) < width:
+            row = list(row) + [None] * (width - len(row))
+        if include_minor_items == "no" and row[minor_idx] != "Major":
+            continue
+        if target_idx is not None:
+            serial = _to_serial(row[target_idx])
+            if serial is None:
+                continue
+            if lower is not None and not serial > lower:
+                continue
+            if upper is not None and not serial < upper:
+                continue
+        values = [row[idx] for idx in col_idx]
+        if all(value is None for value in values):
+            continue
+        for idx in date_idx:
+            values[idx] = _to_serial(values[idx])
+        for column, value in zip(columns, values):
+            column.append(value)
+        kept += 1
+        if chunk_rows and kept == chunk_rows:
+            data = pd.DataFrame(dict(zip(REL_COLS, columns)), columns=REL_COLS)
+            columns = [[] for _ in REL_COLS]
+            kept = 0
+            yielded = True
+            yield compact_dtypes(data)
+
+    if stats is not None:
+        stats["rows_read"] = count
+    if kept or not yielded:
+        data = pd.DataFrame(dict(zip(REL_COLS, columns)), columns=REL_COLS)
+        del columns
+        yield compact_dtypes(data)
+
+
+def compact_dtypes(data):
+    """
+    Description: Stores the text columns as categoricals, the item quantity as the
+                 smallest integer type that fits and the dates as float64 serials.
+
+    Args:
+        data (pandas.DataFrame): Customer data with the columns in REL_COLS.
+
+    Returns:
+        pandas.DataFrame: The same frame with compact column types.
+    """
+    for name in CATEGORY_COLS:
+        data[name] = data[name].astype("category")
+    # a missing quantity adds nothing to the sums the report is built from
+    data["Item Quantity"] = pd.to_numeric(
+        pd.to_numeric(data["Item Quantity"], errors="coerce").fillna(0),
+        downcast="integer",
+    )
+    for name in DATE_COLS:
+        data[name] = data[name].astype("float64")
+    return data
+
+
+def normalize_dates(data):
+    """
+    Description: Converts the raw Excel serial date columns into datetimes.
+                 Columns that already hold datetimes are left alone.
+
+    Args:
+        data (pandas.DataFrame): Customer data as returned by read_customer_data.
+
+    Returns:
+        pandas.DataFrame: The same frame with datetime date columns.
+    """
+    for name in DATE_COLS:
+        if pd.api.types.is_datetime64_any_dtype(data[name]):
+            continue
+        data[name] = pd.to_datetime(
+            pd.to_numeric(data[name]),
+            origin="1899-12-30",
+            unit="D",
+        )
+    return data
+
+
+def load_customer_data(path, cache, checkpoint=None, digest=None):
+    """
+    Description: Returns the column-projected customer data of a report, using a
+                 cache keyed by the content hash of the file. On a hit the workbook
+                 is not decoded at all. Nothing is filtered, so one entry serves every
+                 date window and Major/Minor setting. Dates are kept as Excel serials,
+                 so they can be filtered before they are converted.
+
+    Args:
+        path (str|file): Path or binary file object of the report.
+        cache (DiskCache): Cache the normalized data is stored in.
+        checkpoint (callable): Passed on to read_customer_data.
+        digest (str): content_hash of the report, when the caller already has it.
+
+    Returns:
+        pandas.DataFrame: The projected customer data, see compact_dtypes.
+    """
+    key = f"{digest or content_hash(path)}-v{CACHE_VERSION}"
+    entry = cache.get(key)
+    if entry is not None:
+        return pd.read_feather(entry)
+
+    data = read_customer_data(path, checkpoint=checkpoint)
+    try:
+        cache.put(key, data.to_feather)
+    except Exception as error:
+        # e.g. mixed value types in a column, the data is still usable uncached.
+        print(f"Could not cache customer data: {error}")
+    return data
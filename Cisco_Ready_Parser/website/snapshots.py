@@ -0,0 +1,268 @@
+import hashlib
+import os
+import re
+import uuid
+
+import pandas as pd
+
+from .parser import PORTFOLIOS
+from .writer import DATE_FORMATS, SpreadsheetWriter
+
+SITE = "Install Site GU Name"
+# Columns kept in a snapshot, besides the portfolio, the date target and the site.
+SNAPSHOT_COLS = [
+    "Item Quantity",
+    "Coverage",
+    "Product ID",
+    "Product Description",
+    "Major/Minor",
+]
+# Columns stored as text. A Product ID column can mix numbers and text, which
+# feather cannot store and which cannot be sorted or matched across runs.
+TEXT_COLS = ["Coverage", "Product ID", "Product Description", "Major/Minor", SITE]
+CHANGE_SHEETS = ["New", "Removed", "Quantity Changed", "Date Moved"]
+
+
+def snapshots_path():
+    from django.conf import settings
+
+    return getattr(
+        settings, "PARSER_SNAPSHOT_DIR", os.path.join("media", "snapshots")
+    )
+
+
+def snapshot_key(customer, selected_date_target, include_minor_items, file_type):
+    """
+    Description: Name of the snapshot of a customer. Runs with another date target,
+                 Minor items setting or file type aggregate differently, so they get
+                 their own snapshot. The date window is not part of the key, so a
+                 monthly run with a moving window is compared with the last month.
+
+    Args:
+        customer (str): Name of the customer, usually the name of the upload.
+        selected_date_target (str): Date column the rows are aggregated on.
+        include_minor_items (str): yes/no value of the run.
+        file_type (str): single customer or multiple customers.
+
+    Returns:
+        str: The key, safe to use as a file name.
+    """
+    options = f"{selected_date_target}|{include_minor_items}|{file_type}"
+    digest = hashlib.sha1(options.encode()).hexdigest()[:12]
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", customer).strip("._") or "customer"
+    return f"{name}-{digest}"
+
+
+def snapshot_table(tables, selected_date_target):
+    """
+    Description: Flattens the aggregated tables of a Parser into one compact snapshot.
+
+    Args:
+        tables (dict): Parser.tables, aggregated table of every portfolio.
+        selected_date_target (str): Date column the rows were aggregated on.
+
+    Returns:
+        pandas.DataFrame: One row per portfolio, Product ID, date and site.
+    """
+    frames = []
+    for portfolio in PORTFOLIOS:
+        table = tables[portfolio]
+        columns = SNAPSHOT_COLS + [selected_date_target]
+        if SITE in table.columns:
+            columns.append(SITE)
+        frame = table[columns].rename(columns={selected_date_target: "Date"})
+        frame.insert(0, "Portfolio", portfolio)
+        frames.append(frame)
+    snapshot = pd.concat(frames, ignore_index=True)
+    for name in snapshot.columns:
+        if isinstance(snapshot[name].dtype, pd.CategoricalDtype):
+            snapshot[name] = snapshot[name].astype(object)
+    return _as_text(snapshot)
+
+
+def _as_text(snapshot):
+    # TEXT_COLS as str, missing values stay missing
+    for name in TEXT_COLS:
+        if name in snapshot.columns:
+            values = snapshot[name]
+            snapshot[name] = values.astype(str).where(values.notna(), None)
+    return snapshot
+
+
+def load_snapshot(key):
+    """
+    Description: The latest snapshot stored under key, None if there is none.
+    """
+    try:
+        snapshot = pd.read_feather(os.path.join(snapshots_path(), f"{key}.feather"))
+    except FileNotFoundError:
+        return None
+    # snapshots stored before TEXT_COLS may hold numeric Product IDs
+    return _as_text(snapshot)
+
+
+def save_snapshot(key, snapshot):
+    """
+    Description: Replaces the snapshot stored under key. The snapshot is written to
+                 a temporary file first, so a concurrent reader never sees half of it.
+    """
+    folder = snapshots_path()
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, f".{uuid.uuid4().hex}.tmp")
+    try:
+        snapshot.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, os.path.join(folder, f"{key}.feather"))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _unmatched(left, right, keys):
+    # rows of left without a row with the same keys in right
+    merged = left.merge(right[keys], on=keys, how="left", indicator=True)
+    return merged[merged["_merge"] == "left_only"].drop(columns="_merge")
+
+
+def diff_snapshots(previous, current):
+    """
+    Description: Compares two snapshots of a customer by portfolio, Product ID, site
+                 and date. Rows with the same date and another quantity have their
+                 quantity changed. Rows of a Product ID and site that only exist in
+                 one of the snapshots are paired up in date order; the pairs have
+                 their date moved, the rest are new or removed.
+
+    Args:
+        previous (pandas.DataFrame): Older snapshot, None for a first run.
+        current (pandas.DataFrame): Newer snapshot.
+
+    Returns:
+        dict: A frame for every sheet in CHANGE_SHEETS.
+    """
+    if previous is None:
+        previous = current.iloc[:0]
+    keys = ["Portfolio", "Product ID"]
+    if SITE in current.columns and SITE in previous.columns:
+        keys.append(SITE)
+
+    both = current.merge(
+        previous[keys + ["Date", "Item Quantity"]].rename(
+            columns={"Item Quantity": "Previous Quantity"}
+        ),
+        on=keys + ["Date"],
+    )
+    quantity_changed = both[both["Item Quantity"] != both["Previous Quantity"]]
+
+    added = _unmatched(current, previous, keys + ["Date"])
+    removed = _unmatched(previous, current, keys + ["Date"])
+
+    # the n-th unmatched date of a Product ID pairs with its n-th previous one
+    for frame in (added, removed):
+        frame.sort_values(keys + ["Date"], inplace=True)
+        frame["Pair"] = frame.groupby(keys, dropna=False).cumcount()
+    moved = added.merge(
+        removed[keys + ["Pair", "Date", "Item Quantity"]],
+        on=keys + ["Pair"],
+        how="inner",
+        suffixes=("", " (previous)"),
+    ).rename(
+        columns={
+            "Date (previous)": "Previous Date",
+            "Item Quantity (previous)": "Previous Quantity",
+        }
+    )
+    paired = moved[keys + ["Pair"]].assign(paired=True)
+    new = added.merge(paired, on=keys + ["Pair"], how="left")
+    new = new[new["paired"].isna()]
+    gone = removed.merge(paired, on=keys + ["Pair"], how="left")
+    gone = gone[gone["paired"].isna()]
+
+    changes = {
+        "New": new,
+        "Removed": gone,
+        "Quantity Changed": quantity_changed,
+        "Date Moved": moved,
+    }
+    order = {portfolio: position for position, portfolio in enumerate(PORTFOLIOS)}
+    for sheet, frame in changes.items():
+        frame = frame.assign(_order=frame["Portfolio"].map(order))
+        frame = frame.sort_values(["_order", "Date", "Product ID"], kind="mergesort")
+        changes[sheet] = frame.drop(columns="_order").reset_index(drop=True)
+    return changes
+
+
+def _cell_values(series):
+    values = series.to_numpy(dtype=object)
+    values[pd.isna(values)] = None
+    return values
+
+
+def write_changes_report(changes, output, output_date_format, selected_date_target):
+    """
+    Description: Writes the "what changed" workbook, a sheet for every kind of change
+                 with the rows grouped by portfolio like in the parsed report.
+
+    Args:
+        changes (dict): Result of diff_snapshots.
+        output (str|file): Path or binary file object the workbook is written to.
+        output_date_format (str): Format of the dates in the workbook.
+        selected_date_target (str): Date column the rows were aggregated on.
+    """
+    site = [SITE] if SITE in changes["New"].columns else []
+    base = ["Product ID", "Product Description", "Date", "Major/Minor"]
+    layouts = {
+        "New": ["Item Quantity", "Coverage"] + base,
+        "Removed": ["Item Quantity", "Coverage"] + base,
+        "Quantity Changed": ["Previous Quantity", "Item Quantity"] + base,
+        "Date Moved": ["Item Quantity", "Previous Date"] + base,
+    }
+    number_format = DATE_FORMATS[output_date_format]
+    writer = SpreadsheetWriter(output)
+    for sheet in CHANGE_SHEETS:
+        columns = layouts[sheet] + site
+        header = [
+            {"Item Quantity": "Quantity", "Date": selected_date_target}.get(name, name)
+            for name in columns
+        ]
+        if sheet == "Date Moved":
+            header[1] = f"Previous {selected_date_target}"
+        formats = {
+            position: number_format
+            for position, name in enumerate(columns)
+            if name in ("Date", "Previous Date")
+        }
+        frame = changes[sheet]
+        blocks = []
+        for portfolio in PORTFOLIOS:
+            rows = frame[frame["Portfolio"] == portfolio]
+            blocks.append((portfolio, [_cell_values(rows[name]) for name in columns]))
+        writer.add_sheet(sheet, header, blocks, formats)
+    writer.save()
+
+
+def record_changes(parser, customer, output):
+    """
+    Description: Compares a finished parse with the previous snapshot of the customer,
+                 writes the "what changed" workbook and stores the parse as the new
+                 snapshot.
+
+    Args:
+        parser (Parser): A finished Parser.
+        customer (str): Name of the customer, usually the name of the upload.
+        output (str|file): Path or binary file object the workbook is written to.
+
+    Returns:
+        dict: Number of rows of every sheet in CHANGE_SHEETS.
+    """
+    key = snapshot_key(
+        customer,
+        parser.selected_date_target,
+        parser.include_minor_items,
+        parser.file_type,
+    )
+    current = snapshot_table(parser.tables, parser.selected_date_target)
+    changes = diff_snapshots(load_snapshot(key), current)
+    write_changes_report(
+        changes, output, parser.output_date_format, parser.selected_date_target
+    )
+    save_snapshot(key, current)
+    return {sheet: len(frame) for sheet, frame in changes.items()}
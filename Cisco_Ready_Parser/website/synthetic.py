@@ -0,0 +1,206 @@
+import random
+
+from openpyxl import Workbook
+
+from .reader import HEADER_ROW, to_excel_serial
+
+# Header of the "Powered by Cisco Ready" sheet of a Cisco Ready export.
+FULL_HEADER = [
+    "Serial Number / PAK number",
+    "Coverage",
+    "Covered Line Status",
+    "Business Entity",
+    "Sub Business Entity",
+    "Product Family",
+    "Product ID",
+    "Product Description",
+    "Asset Type",
+    "Product Type",
+    "Buying Program",
+    "Offer Type",
+    "PID Mapping Group",
+    "Item Quantity",
+    "Covered Line Start Date",
+    "Covered Line End Date",
+    "Covered Line End Date FY-FQ",
+    "Contract Type",
+    "Service Brand Code",
+    "Contract Number",
+    "Subscription Reference ID",
+    "Ship Date",
+    "Ship Date FY",
+    "End of Product Sale Date",
+    "Last Renewal Date",
+    "End of Software Maintenance Date",
+    "Last Date of Support",
+    "LDOS FY-FQ",
+    "Migration PID Flag",
+    "End Of Life Product Bulletin",
+    "MSS Extended Support Assessment Result",
+    "MSS Extended Support End Date",
+    "MSS Extended Support Approved Service Level",
+    "Warranty Type",
+    "Warranty End Date",
+    "Install Site GU Name",
+    "Install Site GU ID",
+    "Install Site CR Parent Party Name",
+    "Install Site CR Parent Party ID",
+    "Install Site CR Party Name",
+    "Install Site CR Party ID",
+    "Install Site Name",
+    "Install Site ID",
+    "Install Site Address 1",
+    "Install Site City",
+    "Install Site State",
+    "Install Site Country",
+    "Install Site Postal Code",
+    "Product Bill to ID",
+    "Product Bill to Partner Name",
+    "Product Partner BE GEO ID",
+    "POS Partner BE GEO ID",
+    "POS Partner BE GEO Name",
+    "Service Bill to ID",
+    "Service Bill to Partner Name",
+    "Service Partner BE GEO ID",
+    "Product List Price $",
+    "Default Service List Price $",
+    "Default Service Level",
+    "Existing Coverage Level List Price $",
+    "Instance ID",
+    "Parent Instance ID",
+    "Product SO",
+    "Product PO",
+    "Service SO",
+    "Service PO",
+    "Web Order ID",
+    "Mapped to SWSS (Y/N)",
+    "Auto-renewal flag",
+    "Installed Base Status",
+    "SAV Owner",
+    "SAV ID",
+    "SAV Name",
+    "Major/Minor",
+    "Configuration",
+]
+
+# (Business Entity, Sub Business Entity, Product Type, PID prefix) per portfolio.
+PORTFOLIO_ENTITIES = {
+    "Security": [
+        ("Security", "NGFW", "FIREWALL", "FPR"),
+        ("Security", "Email Security", "APPLIANCE", "ESA"),
+    ],
+    "Collaboration Infrastructure": [
+        ("Collaboration", "Unified Communications", "VOICE", "CUCM"),
+    ],
+    "Collaboration Endpoints": [
+        ("Collaboration", "TP Endpoints", "TELEPRESENCE", "CS-ROOM"),
+        ("Collaboration", "UC Endpoints", "IP PHONE", "CP-88"),
+    ],
+    "Enterprise Routing": [
+        ("Enterprise Routing", "ISR", "ROUTER", "ISR4"),
+        ("Enterprise Routing", "ASR", "ROUTER", "ASR1"),
+    ],
+    "Enterprise Switching": [
+        ("Enterprise Switching", "Cat 9000", "SWITCH", "C9300"),
+        ("Enterprise Switching", "Cat 2K", "SWITCH", "WS-C2960"),
+    ],
+    "Compute": [
+        ("Data Center", "Servers", "SERVER", "UCSC-C220"),
+        ("Data Center", "Hyper Converged", "SERVER", "HX-240"),
+    ],
+    "Wireless": [
+        ("Wireless", "Indoor AP", "WIRELESS", "C9120AX"),
+    ],
+}
+# Business entities outside of every portfolio.
+OTHER_ENTITIES = [
+    ("Service Provider", "Optical", "OPTICAL", "NCS"),
+    ("Cisco Services", "Software", "SOFTWARE", "L-SW"),
+]
+PRODUCTS_PER_ENTITY = 50
+# Share of rows without a date, like items that have no end of life announcement yet.
+MISSING_DATE_RATIO = 0.1
+
+
+def _product_catalog(portfolios, rng):
+    entities = [
+        entity for portfolio in portfolios for entity in PORTFOLIO_ENTITIES[portfolio]
+    ] + OTHER_ENTITIES
+    catalog = []
+    for entity, sub_entity, product_type, prefix in entities:
+        for number in range(PRODUCTS_PER_ENTITY):
+            end_of_sale = to_excel_serial("2015-01-01") + rng.randint(0, 15 * 365)
+            catalog.append(
+                {
+                    "Business Entity": entity,
+                    "Sub Business Entity": sub_entity,
+                    "Product Type": product_type,
+                    "Product ID": f"{prefix}-{number:03d}",
+                    "Product Description": (
+                        f"{sub_entity} {product_type.title()} model {number:03d}"
+                    ),
+                    "End of Product Sale Date": end_of_sale,
+                    "End of Software Maintenance Date": end_of_sale + 365,
+                    "Last Renewal Date": end_of_sale + 3 * 365,
+                    "Last Date of Support": end_of_sale + 5 * 365,
+                }
+            )
+    return catalog
+
+
+def generate_report(
+    path,
+    rows,
+    customers=1,
+    sites=10,
+    portfolios=None,
+    minor_ratio=0.3,
+    seed=0,
+):
+    """
+    Description: Writes a synthetic Cisco Ready style report, used to test and benchmark
+                 the Parser at realistic sizes. The layout matches the real exports:
+                 three banner rows, the full header row and one row per item.
+                 Every product keeps the same entity and dates on all its rows.
+                 No library can write .xlsb, so the report is an .xlsx workbook.
+
+    Args:
+        path (str): Where the .xlsx file is written to.
+        rows (int): Number of item rows.
+        customers (int): Number of distinct Install Site GU Names.
+        sites (int): Number of distinct install sites per customer.
+        portfolios (list): Portfolios the items are drawn from, defaults to all of them.
+        minor_ratio (float): Share of Minor items.
+        seed (int): Seed of the random generator, the same seed gives the same report.
+    """
+    rng = random.Random(seed)
+    catalog = _product_catalog(portfolios or list(PORTFOLIO_ENTITIES), rng)
+    customer_names = [f"CUSTOMER {number:04d}" for number in range(customers)]
+    positions = {name: idx for idx, name in enumerate(FULL_HEADER)}
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Powered by Cisco Ready")
+    for _ in range(HEADER_ROW):
+        worksheet.append([])
+    worksheet.append(FULL_HEADER)
+
+    for number in range(rows):
+        product = rng.choice(catalog)
+        customer = rng.randrange(customers)
+        site = rng.randrange(sites)
+        row = [None] * len(FULL_HEADER)
+        for name, value in product.items():
+            row[positions[name]] = value
+        if rng.random() < MISSING_DATE_RATIO:
+            row[positions["Last Date of Support"]] = None
+        row[positions["Serial Number / PAK number"]] = f"FOC{number:08d}"
+        row[positions["Coverage"]] = rng.choice(["COVERED", "NOT COVERED"])
+        row[positions["Item Quantity"]] = rng.choice([1, 1, 1, 2, 4])
+        row[positions["Install Site GU Name"]] = customer_names[customer]
+        row[positions["Install Site Name"]] = f"SITE {customer:04d}-{site:03d}"
+        row[positions["Install Site ID"]] = customer * sites + site
+        row[positions["Major/Minor"]] = (
+            "Minor" if rng.random() < minor_ratio else "Major"
+        )
+        worksheet.append(row)
+    workbook.save(path)
@@ -1,7 +1,36 @@
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, override_settings
+from .cache import DiskCache
+from .file_handler import SCRATCH_PATH
 from .forms import UploadFileForm, UploadFolderForm
+from .jobs import job_dir, remove_expired_jobs
+from .parser import (
+    SHEET_DATES,
+    SHEETS,
+    ParseCancelled,
+    Parser,
+    _sheet_orders,
+    write_consolidated_report,
+)
+from .snapshots import record_changes, snapshot_key, snapshots_path
+from .reader import (
+    DATE_COLS,
+    REL_COLS,
+    iter_customer_data,
+    normalize_dates,
+    read_customer_data,
+    to_excel_serial,
+)
+from .synthetic import generate_report
+from .threading_handle import parse_file
+from .worker_pool import WorkerPool, get_sheet_pool
+from . import writer
+from .writer import SpreadsheetWriter
 from django.urls import reverse
-import datetime, random
+from openpyxl import Workbook, load_workbook
+from unittest import mock
+import pandas as pd
+import datetime, io, json, os, random, shutil, subprocess, sys, tempfile, threading, time, zipfile
 
 
 def random_dates(start_year, end_year):
@@ -17,6 +46,1241 @@ def random_dates(start_year, end_year):
     return random_date
 
 
+class CountingPool(WorkerPool):
+    """WorkerPool counting the jobs submitted to it."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(fn, *args, **kwargs)
+
+
+REPORT_HEADER = ["Serial Number / PAK number"] + REL_COLS + ["Configuration"]
+
+
+def report_row(**values):
+    row = {
+        "Item Quantity": 1,
+        "Coverage": "COVERED",
+        "Product ID": "C9300-48P",
+        "Product Description": "Catalyst 9300 48-port PoE+",
+        "End of Product Sale Date": to_excel_serial("2025-01-01"),
+        "Last Renewal Date": to_excel_serial("2026-01-01"),
+        "End of Software Maintenance Date": to_excel_serial("2027-01-01"),
+        "Last Date of Support": to_excel_serial("2030-01-01"),
+        "Business Entity": "Enterprise Switching",
+        "Sub Business Entity": "Cat 9300",
+        "Product Type": "SWITCH",
+        "Major/Minor": "Major",
+        "Install Site GU Name": "ACME",
+    }
+    row.update(values)
+    return row
+
+
+def write_report(path, rows):
+    workbook = Workbook()
+    worksheet = workbook.active
+    for _ in range(3):
+        worksheet.append([None])
+    worksheet.append(REPORT_HEADER)
+    for row in rows:
+        worksheet.append([row.get(name, "FOC1") for name in REPORT_HEADER])
+    workbook.save(path)
+
+
+def parse_on_sheet_pool(report, output):
+    """Runs in a pool worker, parses report with its sheets rendered on the sheet pool."""
+    from django.conf import settings
+
+    settings.PARSER_SHEET_WORKERS = 2
+    Parser.PARALLEL_SHEET_ROWS = 0
+    parse_file(
+        report,
+        output,
+        "2020-01-01",
+        "2035-01-01",
+        "yes",
+        "DD/MM/YYYY",
+        "Last Date of Support",
+        cache_output=False,
+    )
+    return get_sheet_pool().max_workers
+
+
+def portfolio_rows(data, portfolio, selected_date_target, file_type):
+    """The table of a portfolio the way Parser built it one portfolio at a time."""
+    data = data.astype(
+        {name: object for name in data.columns if data[name].dtype == "category"}
+    )
+    if portfolio == "Collaboration Endpoints":
+        rows = data[data["Sub Business Entity"].isin(["TP Endpoints", "UC Endpoints"])]
+    elif portfolio == "Collaboration Infrastructure":
+        rows = data[data["Business Entity"] == "Collaboration"]
+        rows = rows[~rows["Sub Business Entity"].isin(["TP Endpoints", "UC Endpoints"])]
+    elif portfolio == "Compute":
+        rows = data[data["Sub Business Entity"].isin(["Servers", "Hyper Converged"])]
+    else:
+        rows = data[data["Business Entity"] == portfolio]
+    columns = [name for name in REL_COLS if name not in (
+        "Business Entity", "Sub Business Entity", "Product Type"
+    )]
+    if file_type == "single customer":
+        columns.remove("Install Site GU Name")
+    agg_map = {name: "first" for name in columns}
+    agg_map["Item Quantity"] = "sum"
+    table = rows.groupby(["Product ID", selected_date_target]).agg(agg_map)
+    table = table.reset_index(drop=True)
+    table = table.sort_values(by=selected_date_target, kind="stable")
+    return table
+
+
+class ReaderTestCase(TestCase):
+    def test_streaming_reader_projects_and_filters(self):
+        rows = [
+            report_row(),
+            report_row(**{"Major/Minor": "Minor"}),
+            report_row(**{"Last Date of Support": to_excel_serial("2040-01-01")}),
+            report_row(**{"Last Date of Support": None}),
+        ]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(path, rows)
+            data = read_customer_data(
+                path, "2020-01-01", "2035-01-01", "Last Date of Support", "no"
+            )
+            self.assertEqual(list(data.columns), REL_COLS)
+            self.assertEqual(len(data), 1)
+            data = read_customer_data(
+                path, "2020-01-01", "2035-01-01", "Last Date of Support", "yes"
+            )
+            self.assertEqual(len(data), 2)
+
+    def test_streaming_reader_yields_chunks(self):
+        rows = [report_row(**{"Item Quantity": quantity}) for quantity in range(1, 6)]
+        rows.insert(2, report_row(**{"Major/Minor": "Minor"}))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(path, rows)
+            stats = {}
+            chunks = list(
+                iter_customer_data(
+                    path,
+                    "2020-01-01",
+                    "2035-01-01",
+                    "Last Date of Support",
+                    "no",
+                    chunk_rows=2,
+                    stats=stats,
+                )
+            )
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual(
+            [list(chunk["Item Quantity"]) for chunk in chunks], [[1, 2], [3, 4], [5]]
+        )
+        self.assertEqual(stats["rows_read"], 6)
+
+    def test_streaming_reader_uses_compact_types(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(path, [report_row(), report_row(**{"Item Quantity": None})])
+            data = read_customer_data(path)
+        self.assertEqual(data["Product ID"].dtype, "category")
+        self.assertEqual(data["Major/Minor"].dtype, "category")
+        self.assertEqual(data["Item Quantity"].dtype, "int8")
+        self.assertEqual(data["Item Quantity"].tolist(), [1, 0])
+
+    def test_streaming_reader_reads_xlsx_without_extension(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report")
+            write_report(path, [report_row()])
+            data = read_customer_data(path)
+        self.assertEqual(len(data), 1)
+
+    def test_streaming_reader_reads_xlsb(self):
+        data = read_customer_data("media/test_files/empty.xlsb")
+        self.assertEqual(list(data.columns), REL_COLS)
+        self.assertTrue(data.empty)
+
+
+class ParserTestCase(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.report = os.path.join(self.folder.name, "report.xlsx")
+        write_report(
+            self.report,
+            [
+                report_row(),
+                report_row(**{"Item Quantity": 2}),
+                report_row(
+                    **{
+                        "Business Entity": "Security",
+                        "Product ID": "FPR1010",
+                        "Last Date of Support": to_excel_serial("2029-01-01"),
+                    }
+                ),
+            ],
+        )
+
+    def parse(self, **kwargs):
+        output = os.path.join(self.folder.name, "report_parsed.xlsx")
+        Parser(
+            self.report,
+            output,
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            "DD/MM/YYYY",
+            "Last Date of Support",
+            **kwargs,
+        )
+        return output
+
+    def test_write_only_matches_default_writer(self):
+        default = load_workbook(self.parse(writer="openpyxl"))
+        streamed = load_workbook(self.parse(writer="openpyxl", write_only=True))
+        self.assertEqual(default.sheetnames, ["LDoS", "EoSMD", "EoPSD", "LRD"])
+        self.assertEqual(default.sheetnames, streamed.sheetnames)
+        for title in default.sheetnames:
+            self.assertEqual(
+                list(default[title].values), list(streamed[title].values)
+            )
+        worksheet = streamed["LDoS"]
+        self.assertEqual(worksheet["A2"].value, "Security")
+        self.assertTrue(worksheet["A2"].font.b)
+        self.assertEqual(worksheet["A5"].value, "Enterprise Switching")
+        self.assertEqual(worksheet["A6"].value, 3)
+
+    def test_spreadsheet_writer_matches_openpyxl(self):
+        for file_type in ["single customer", "multiple customers"]:
+            expected = load_workbook(
+                self.parse(file_type=file_type, writer="openpyxl")
+            )
+            written = load_workbook(self.parse(file_type=file_type))
+            self.assertEqual(expected.sheetnames, written.sheetnames)
+            for title in expected.sheetnames:
+                self.assertEqual(
+                    list(expected[title].values), list(written[title].values)
+                )
+                for expected_row, row in zip(expected[title].rows, written[title].rows):
+                    self.assertEqual(
+                        [(bool(cell.font.b), cell.number_format) for cell in expected_row],
+                        [(bool(cell.font.b), cell.number_format) for cell in row],
+                    )
+                widths = [
+                    {name: column.width for name, column in sheet.column_dimensions.items()}
+                    for sheet in (expected[title], written[title])
+                ]
+                self.assertEqual(widths[0], widths[1])
+
+    def test_sheets_rendered_in_parallel_match_default_writer(self):
+        pool = WorkerPool(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        default = load_workbook(self.parse())
+        output = os.path.join(self.folder.name, "report_parallel.xlsx")
+        parser = Parser(
+            self.report,
+            output,
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            "DD/MM/YYYY",
+            "Last Date of Support",
+            sheet_pool=pool,
+            run=False,
+        )
+        parser.PARALLEL_SHEET_ROWS = 0
+        parser.run()
+        self.assertIn("write_LRD", parser.stats["stages"])
+        parallel = load_workbook(output)
+        self.assertEqual(default.sheetnames, parallel.sheetnames)
+        for title in default.sheetnames:
+            self.assertEqual(
+                list(default[title].values), list(parallel[title].values)
+            )
+            for expected, actual in zip(default[title].rows, parallel[title].rows):
+                self.assertEqual(
+                    [(cell.font.b, cell.number_format) for cell in expected],
+                    [(cell.font.b, cell.number_format) for cell in actual],
+                )
+            self.assertEqual(parallel[title].column_dimensions["D"].width, 59)
+
+    def test_sheets_are_rendered_on_the_pool_from_the_threshold_on(self):
+        pool = CountingPool(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        options = ["2020-01-01", "2035-01-01", "yes", "DD/MM/YYYY", "Last Date of Support"]
+        rows = Parser(self.report, io.BytesIO(), *options).stats["output_rows"]
+        workbooks = []
+        for threshold, submitted in [(rows + 1, 0), (rows, len(SHEETS))]:
+            output = io.BytesIO()
+            parser = Parser(self.report, output, *options, sheet_pool=pool, run=False)
+            parser.PARALLEL_SHEET_ROWS = threshold
+            parser.run()
+            self.assertEqual(pool.submitted, submitted)
+            workbooks.append(load_workbook(output))
+        for title in SHEETS:
+            self.assertEqual(
+                list(workbooks[0][title].values), list(workbooks[1][title].values)
+            )
+
+    def test_parse_on_a_full_pool_renders_sheets_on_its_own_pool(self):
+        # the only slot of the pool is held by the parse itself while its sheets render
+        pool = WorkerPool(max_workers=1, max_pending=1)
+        self.addCleanup(pool.shutdown)
+        default = load_workbook(self.parse())
+        output = os.path.join(self.folder.name, "report_parallel.xlsx")
+        future = pool.submit(parse_on_sheet_pool, self.report, output)
+        self.assertEqual(future.result(timeout=120), 2)
+        parallel = load_workbook(output)
+        for title in SHEETS:
+            self.assertEqual(
+                list(default[title].values), list(parallel[title].values)
+            )
+
+    def test_chunked_parse_matches_whole_parse(self):
+        for file_type in ["single customer", "multiple customers"]:
+            whole = load_workbook(self.parse(file_type=file_type))
+            chunked = load_workbook(self.parse(file_type=file_type, chunk_rows=1))
+            for title in whole.sheetnames:
+                self.assertEqual(
+                    list(whole[title].values), list(chunked[title].values)
+                )
+        self.assertEqual(chunked["LDoS"]["A6"].value, 3)
+
+    def test_chunked_parse_keeps_numeric_ids_and_report_order(self):
+        servers = {"Business Entity": "Data Center", "Sub Business Entity": "Servers"}
+        dual = {"Business Entity": "Security", "Sub Business Entity": "Servers"}
+        write_report(
+            self.report,
+            [
+                report_row(**{"Product ID": 1001}),
+                report_row(**dual, **{"Product ID": "UCSC-C220"}),
+                report_row(
+                    **servers,
+                    **{
+                        "Product ID": "UCSC-C220",
+                        "Product Description": "Listed under Servers",
+                        "Coverage": "NOT COVERED",
+                    },
+                ),
+                report_row(**{"Product ID": 1001, "Item Quantity": 2}),
+                report_row(**dual, **{"Product ID": 42}),
+                report_row(**servers, **{"Product ID": 42, "Coverage": "NOT COVERED"}),
+            ],
+        )
+        for file_type in ["single customer", "multiple customers"]:
+            whole = load_workbook(self.parse(file_type=file_type))
+            for chunk_rows in [1, 2, 4]:
+                chunked = load_workbook(
+                    self.parse(file_type=file_type, chunk_rows=chunk_rows)
+                )
+                for title in whole.sheetnames:
+                    self.assertEqual(
+                        list(whole[title].values),
+                        list(chunked[title].values),
+                        (file_type, chunk_rows, title),
+                    )
+        rows = list(chunked["LDoS"].values)
+        self.assertIn((3, "COVERED", 1001), [row[:3] for row in rows])
+        compute = rows[[row[0] for row in rows].index("Compute") + 1 :]
+        self.assertIn((2, "COVERED", "UCSC-C220"), [row[:3] for row in compute])
+
+    def test_date_window_applies_to_serial_and_datetime_cells(self):
+        rows = [report_row(), report_row(**{"Product ID": "C9200-24T"})]
+        rows[1]["Last Date of Support"] = to_excel_serial("2040-01-01")
+        write_report(self.report, rows)
+        serials = load_workbook(self.parse(reader="pandas"))["LDoS"]
+        for row in rows:
+            for name in DATE_COLS:
+                row[name] = datetime.datetime(1899, 12, 30) + datetime.timedelta(
+                    days=row[name]
+                )
+        write_report(self.report, rows)
+        datetimes = load_workbook(self.parse(reader="pandas"))["LDoS"]
+        self.assertEqual(list(serials.values), list(datetimes.values))
+        self.assertEqual(serials.max_row, 3)
+
+    def test_sheet_orders_match_sorting_in_place(self):
+        random.seed(3)
+        choices = [None] + [random_dates(2020, 2022) for _ in range(5)]
+        df = pd.DataFrame(
+            {
+                name: pd.to_datetime([random.choice(choices) for _ in range(200)])
+                for name in SHEET_DATES.values()
+            }
+        )
+        df["position"] = range(len(df))
+        orders = _sheet_orders(df)
+        for title in SHEETS[1:]:
+            df.sort_values(by=SHEET_DATES[title], inplace=True)
+            self.assertEqual(orders[title].tolist(), df["position"].tolist())
+
+    def test_data_only_formats_hold_the_rows_of_every_sheet(self):
+        workbook = load_workbook(self.parse())
+        expected = []
+        for title in workbook.sheetnames:
+            portfolio = None
+            for row in list(workbook[title].values)[1:]:
+                if row[1] is None:
+                    portfolio = row[0]
+                    continue
+                expected.append(
+                    [title, portfolio, row[0], row[2], row[4].strftime("%Y-%m-%d")]
+                )
+
+        tables = {}
+        for output_format in ["csv", "jsonl", "parquet"]:
+            output = os.path.join(self.folder.name, f"report.{output_format}")
+            Parser(
+                self.report,
+                output,
+                "2020-01-01",
+                "2035-01-01",
+                "yes",
+                "YYYY/MM/DD",
+                "Last Date of Support",
+                output_format=output_format,
+            )
+            self.assertFalse(zipfile.is_zipfile(output))
+            if output_format == "csv":
+                tables[output_format] = pd.read_csv(output, parse_dates=["Date"])
+            elif output_format == "jsonl":
+                tables[output_format] = pd.read_json(output, lines=True)
+            else:
+                tables[output_format] = pd.read_parquet(output)
+        for output_format, table in tables.items():
+            rows = table[["Sheet", "Portfolio", "Quantity", "Product ID", "Date"]]
+            rows = [
+                [sheet, portfolio, quantity, product, date.strftime("%Y-%m-%d")]
+                for sheet, portfolio, quantity, product, date in rows.values.tolist()
+            ]
+            self.assertEqual(rows, expected, output_format)
+
+    def test_parquet_keeps_numeric_product_ids_next_to_text_ones(self):
+        write_report(self.report, [report_row(), report_row(**{"Product ID": 1001})])
+        output = os.path.join(self.folder.name, "report.parquet")
+        Parser(
+            self.report,
+            output,
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            "YYYY/MM/DD",
+            "Last Date of Support",
+            output_format="parquet",
+        )
+        table = pd.read_parquet(output)
+        ldos = table[table["Sheet"] == "LDoS"]
+        self.assertEqual(sorted(ldos["Product ID"]), ["1001", "C9300-48P"])
+
+    def test_dates_are_written_as_date_cells(self):
+        writers = [{}, {"writer": "openpyxl"}, {"writer": "openpyxl", "write_only": True}]
+        for options in writers:
+            worksheet = load_workbook(self.parse(**options))["LDoS"]
+            # A2 is the Security category, its row follows
+            self.assertEqual(worksheet["E3"].value, datetime.datetime(2029, 1, 1))
+            self.assertEqual(worksheet["E3"].number_format, "dd/mm/yyyy")
+
+    def test_rows_matching_two_portfolios_are_in_both(self):
+        write_report(
+            self.report,
+            [
+                report_row(
+                    **{"Business Entity": "Security", "Sub Business Entity": "Servers"}
+                ),
+                report_row(
+                    **{
+                        "Business Entity": "Collaboration",
+                        "Sub Business Entity": "Phones",
+                    }
+                ),
+                report_row(
+                    **{
+                        "Business Entity": "Collaboration",
+                        "Sub Business Entity": "TP Endpoints",
+                    }
+                ),
+            ],
+        )
+        worksheet = load_workbook(self.parse())["LDoS"]
+        categories = [
+            row[0]
+            for row in worksheet.iter_rows(values_only=True)
+            if isinstance(row[0], str)
+        ]
+        self.assertEqual(
+            categories,
+            [
+                "Quantity",
+                "Security",
+                "Collaboration Infrastructure",
+                "Collaboration Endpoints",
+                "Compute",
+            ],
+        )
+
+    def test_portfolio_tables_match_parsing_portfolios_one_by_one(self):
+        servers = {"Business Entity": "Data Center", "Sub Business Entity": "Servers"}
+        write_report(
+            self.report,
+            [
+                report_row(
+                    **{
+                        "Business Entity": "Security",
+                        "Sub Business Entity": "Servers",
+                        "Product ID": "UCSC-C220",
+                        "Product Description": "Listed under Security",
+                    }
+                ),
+                report_row(
+                    **servers,
+                    **{
+                        "Product ID": "UCSC-C220",
+                        "Product Description": "Listed under Servers",
+                        "Coverage": "NOT COVERED",
+                        "Item Quantity": 2,
+                    },
+                ),
+                report_row(**servers, **{"Product ID": "UCSC-C240"}),
+                report_row(
+                    **{
+                        "Business Entity": "Security",
+                        "Sub Business Entity": "Firewalls",
+                        "Product ID": "UCSC-C220",
+                    }
+                ),
+            ],
+        )
+        for file_type in ["single customer", "multiple customers"]:
+            parser = Parser(
+                self.report,
+                os.path.join(self.folder.name, "report_parsed.xlsx"),
+                "2020-01-01",
+                "2035-01-01",
+                "yes",
+                "DD/MM/YYYY",
+                "Last Date of Support",
+                file_type,
+            )
+            data = normalize_dates(read_customer_data(self.report))
+            for portfolio in ["Security", "Compute"]:
+                table = parser.tables[portfolio]
+                expected = portfolio_rows(
+                    data, portfolio, "Last Date of Support", file_type
+                )
+                self.assertEqual(
+                    table.astype(object).values.tolist(),
+                    expected[table.columns].values.tolist(),
+                    portfolio,
+                )
+            compute = parser.tables["Compute"]
+            self.assertEqual(
+                compute["Product Description"].tolist()[0], "Listed under Security"
+            )
+
+    def test_cancelled_parse_stops(self):
+        event = threading.Event()
+        event.set()
+        with self.assertRaises(ParseCancelled):
+            self.parse(cancel_event=event)
+
+
+    def test_progress_is_reported_per_stage(self):
+        stages = []
+        self.parse(progress=lambda stage, **info: stages.append((stage, info)))
+        self.assertEqual(
+            [stage for stage, _ in stages],
+            ["reading", "aggregating", "writing", "writing", "writing", "writing"],
+        )
+        self.assertEqual(stages[1][1], {"input_rows": 3})
+        self.assertEqual(
+            stages[-1][1],
+            {"sheet": 4, "sheets": 4, "input_rows": 3, "output_rows": 2},
+        )
+
+    def test_stats_are_recorded_per_stage(self):
+        parser = Parser(
+            self.report,
+            os.path.join(self.folder.name, "report_parsed.xlsx"),
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            "DD/MM/YYYY",
+            "Last Date of Support",
+        )
+        self.assertEqual(
+            set(parser.stats["stages"]),
+            {"load", "date_conversion", "filtering", "aggregation", "save"}
+            | {f"write_{title}" for title in ["LDoS", "EoSMD", "EoPSD", "LRD"]},
+        )
+        self.assertEqual(parser.stats["input_rows"], 3)
+        # the two switch rows are aggregated into one
+        self.assertEqual(parser.stats["output_rows"], 2)
+        self.assertEqual(parser.stats["input_bytes"], os.path.getsize(self.report))
+        self.assertGreater(parser.stats["output_bytes"], 0)
+
+    def test_consolidated_report_matches_parsing_reports_together(self):
+        second = [
+            report_row(**{"Item Quantity": 4}),
+            report_row(**{"Product ID": "C9200-24T", "Business Entity": "Security"}),
+            # numeric Product IDs stay numbers, even next to text ones
+            report_row(**{"Product ID": 1001, "Business Entity": "Security"}),
+        ]
+        second_report = os.path.join(self.folder.name, "second.xlsx")
+        write_report(second_report, second)
+        combined = os.path.join(self.folder.name, "combined.xlsx")
+        first = [row for row in load_workbook(self.report).active.values][4:]
+        write_report(
+            combined,
+            [dict(zip(REPORT_HEADER, row)) for row in first] + second,
+        )
+
+        partials = []
+        for path in [self.report, second_report]:
+            partials.append(
+                Parser(
+                    path,
+                    os.path.join(self.folder.name, "partial.xlsx"),
+                    "2020-01-01",
+                    "2035-01-01",
+                    "yes",
+                    "DD/MM/YYYY",
+                    "Last Date of Support",
+                ).tables
+            )
+        consolidated = os.path.join(self.folder.name, "consolidated.xlsx")
+        write_consolidated_report(
+            partials, consolidated, "DD/MM/YYYY", "Last Date of Support"
+        )
+        self.report = combined
+        expected = load_workbook(self.parse())
+        consolidated = load_workbook(consolidated)
+        self.assertEqual(expected.sheetnames, consolidated.sheetnames)
+        for title in expected.sheetnames:
+            self.assertEqual(
+                list(expected[title].values), list(consolidated[title].values)
+            )
+        self.assertIn(
+            (7, "COVERED", "C9300-48P"),
+            [row[:3] for row in consolidated["LDoS"].values],
+        )
+        self.assertIn(1001, [row[2] for row in consolidated["LDoS"].values])
+
+    def test_consolidated_sheets_are_rendered_on_the_pool(self):
+        pool = CountingPool(max_workers=2)
+        self.addCleanup(pool.shutdown)
+        options = ["2020-01-01", "2035-01-01", "yes", "DD/MM/YYYY", "Last Date of Support"]
+        parser = Parser(self.report, io.BytesIO(), *options)
+        output = io.BytesIO()
+        with mock.patch.object(Parser, "PARALLEL_SHEET_ROWS", 1):
+            consolidated = write_consolidated_report(
+                [parser.tables],
+                output,
+                "DD/MM/YYYY",
+                "Last Date of Support",
+                sheet_pool=pool,
+            )
+        self.assertEqual(pool.submitted, len(SHEETS))
+        self.assertEqual(
+            consolidated.stats["output_rows"], parser.stats["output_rows"]
+        )
+        self.assertEqual(
+            list(load_workbook(output)["LDoS"].values),
+            list(load_workbook(parser.output)["LDoS"].values),
+        )
+
+    def test_input_cache_is_reused(self):
+        cache = DiskCache(os.path.join(self.folder.name, "cache"), 10**9, ".feather")
+        expected = load_workbook(self.parse())
+        load_workbook(self.parse(input_cache=cache))
+        self.assertEqual(len(os.listdir(cache.path)), 1)
+        cached = load_workbook(self.parse(input_cache=cache))
+        for title in expected.sheetnames:
+            self.assertEqual(list(expected[title].values), list(cached[title].values))
+
+
+class SpreadsheetWriterTestCase(TestCase):
+    def test_text_is_stored_once_and_escaped(self):
+        output = io.BytesIO()
+        writer = SpreadsheetWriter(output)
+        columns = [
+            [1, 2, 3],
+            ["C9300-48P", "C9300-48P", "A&B <1>"],
+            [datetime.datetime(2030, 1, 1), None, datetime.datetime(1900, 2, 1)],
+        ]
+        writer.add_sheet(
+            "LDoS",
+            ["Quantity", "Product ID", "Date"],
+            [("Cat", columns)],
+            {2: "dd/mm/yyyy"},
+        )
+        writer.save()
+        with zipfile.ZipFile(output) as archive:
+            strings = archive.read("xl/sharedStrings.xml").decode()
+        # the header, the category and two distinct Product IDs
+        self.assertIn('uniqueCount="6"', strings)
+        self.assertIn("A&amp;B &lt;1&gt;", strings)
+        worksheet = load_workbook(output)["LDoS"]
+        self.assertEqual(
+            list(worksheet.values),
+            [
+                ("Quantity", "Product ID", "Date"),
+                ("Cat", None, None),
+                (1, "C9300-48P", datetime.datetime(2030, 1, 1)),
+                (2, "C9300-48P", None),
+                (3, "A&B <1>", datetime.datetime(1900, 2, 1)),
+            ],
+        )
+        self.assertTrue(worksheet["A2"].font.b)
+        self.assertEqual(worksheet["C3"].number_format, "dd/mm/yyyy")
+        self.assertEqual(worksheet.column_dimensions["D"].width, 59)
+
+    def test_large_workbook_spills_to_disk(self):
+        columns = [list(range(5000)), [f"PID-{i}" for i in range(5000)]]
+        outputs = []
+        for spool_bytes in [writer.SPOOL_BYTES, 1024]:
+            with mock.patch.object(writer, "SPOOL_BYTES", spool_bytes):
+                output = io.BytesIO()
+                spreadsheet = SpreadsheetWriter(output)
+                spreadsheet.add_sheet("LDoS", ["Quantity", "Product ID"], [("Cat", columns)])
+                self.assertEqual(spreadsheet.file._rolled, spool_bytes == 1024)
+                spreadsheet.save()
+                outputs.append(list(load_workbook(output)["LDoS"].values))
+        self.assertEqual(len(outputs[1]), 5002)
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class ChangesReportTestCase(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        settings = override_settings(
+            PARSER_SNAPSHOT_DIR=os.path.join(self.folder.name, "snapshots")
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def run_parse(self, rows):
+        report = os.path.join(self.folder.name, "report.xlsx")
+        write_report(report, rows)
+        parser = Parser(
+            report,
+            io.BytesIO(),
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            "DD/MM/YYYY",
+            "Last Date of Support",
+        )
+        changes = io.BytesIO()
+        counts = record_changes(parser, "ACME", changes)
+        return counts, load_workbook(changes)
+
+    def test_changes_since_previous_run(self):
+        routing = {"Business Entity": "Enterprise Routing", "Product ID": "ISR4331"}
+        security = {"Business Entity": "Security", "Product ID": "FPR1010"}
+        counts, _ = self.run_parse(
+            [
+                report_row(**{"Item Quantity": 3}),
+                report_row(**security),
+                report_row(**routing),
+            ]
+        )
+        self.assertEqual(counts["New"], 3)
+        self.assertEqual(counts["Removed"], 0)
+
+        counts, workbook = self.run_parse(
+            [
+                report_row(**{"Item Quantity": 5}),
+                report_row(
+                    **security,
+                    **{"Last Date of Support": to_excel_serial("2031-01-01")},
+                ),
+                report_row(**{"Business Entity": "Wireless", "Product ID": "C9130AXI"}),
+            ]
+        )
+        self.assertEqual(
+            counts, {"New": 1, "Removed": 1, "Quantity Changed": 1, "Date Moved": 1}
+        )
+        self.assertEqual(workbook.sheetnames, ["New", "Removed", "Quantity Changed", "Date Moved"])
+        rows = {
+            sheet: [row for row in workbook[sheet].iter_rows(values_only=True)]
+            for sheet in workbook.sheetnames
+        }
+        self.assertEqual(rows["New"][1][0], "Wireless")
+        self.assertEqual(rows["New"][2][:3], (1, "COVERED", "C9130AXI"))
+        self.assertEqual(rows["Removed"][1][0], "Enterprise Routing")
+        self.assertEqual(rows["Removed"][2][2], "ISR4331")
+        self.assertEqual(rows["Quantity Changed"][0][:2], ("Previous Quantity", "Quantity"))
+        self.assertEqual(rows["Quantity Changed"][2][:3], (3, 5, "C9300-48P"))
+        self.assertEqual(rows["Date Moved"][2][1], datetime.datetime(2030, 1, 1))
+        self.assertEqual(rows["Date Moved"][2][4], datetime.datetime(2031, 1, 1))
+        self.assertEqual(
+            workbook["Date Moved"].cell(3, 5).number_format, "dd/mm/yyyy"
+        )
+
+    def test_numeric_product_ids_next_to_text_ones(self):
+        rows = [report_row(), report_row(**{"Product ID": 1001})]
+        counts, _ = self.run_parse(rows)
+        self.assertEqual(counts["New"], 2)
+        counts, workbook = self.run_parse(
+            rows + [report_row(**{"Product ID": 1002, "Item Quantity": 2})]
+        )
+        self.assertEqual(counts["New"], 1)
+        self.assertEqual(counts["Removed"], 0)
+        self.assertEqual(workbook["New"]["C3"].value, "1002")
+
+
+class BenchmarkTestCase(TestCase):
+    def test_generated_report_is_parsed(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            generate_report(path, 200, customers=2, minor_ratio=0.5, seed=1)
+            data = read_customer_data(path)
+        self.assertEqual(len(data), 200)
+        self.assertEqual(data["Install Site GU Name"].nunique(), 2)
+        self.assertEqual(set(data["Major/Minor"]), {"Major", "Minor"})
+
+    def test_benchmark_records_every_stage(self):
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, "results.jsonl")
+            call_command(
+                "benchmark_parser",
+                sizes="100",
+                repeat=1,
+                output=output,
+                data_dir=folder,
+                stdout=io.StringIO(),
+            )
+            with open(output) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(
+            [record["stage"] for record in records],
+            [
+                "read",
+                "respect_date_interval",
+                "select_rel_columns",
+                "parse",
+                "setup_excel",
+                "write_LDoS",
+                "write_EoSMD",
+                "write_EoPSD",
+                "write_LRD",
+                "save_excel",
+            ],
+        )
+        self.assertTrue(all(record["rows"] == 100 for record in records))
+
+
+class BatchParseTestCase(TestCase):
+    def test_reports_are_parsed_once(self):
+        with tempfile.TemporaryDirectory() as folder:
+            write_report(os.path.join(folder, "first.xlsx"), [report_row()])
+            write_report(os.path.join(folder, "second.xlsx"), [report_row()] * 3)
+            options = {
+                "start_date": "2000-01-01",
+                "end_date": "2100-01-01",
+                "workers": 1,
+            }
+            stdout = io.StringIO()
+            call_command("batch_parse", folder, stdout=stdout, **options)
+            self.assertIn("Parsed 2 files (0 skipped, 0 failed), 4 rows", stdout.getvalue())
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(folder, "parsed"))),
+                [".batch_parse.json", "first_parsed.xlsx", "second_parsed.xlsx"],
+            )
+
+            stdout = io.StringIO()
+            call_command("batch_parse", folder, stdout=stdout, **options)
+            self.assertIn("Parsed 0 files (2 skipped, 0 failed)", stdout.getvalue())
+
+            # other options make every output stale
+            stdout = io.StringIO()
+            options["date_format"] = "YYYY/MM/DD"
+            call_command("batch_parse", folder, stdout=stdout, **options)
+            self.assertIn("Parsed 2 files (0 skipped, 0 failed)", stdout.getvalue())
+
+            # a run that fails half way leaves no output looking up to date for
+            # the options of the run before
+            with open(os.path.join(folder, "broken.xlsx"), "wb") as f:
+                f.write(b"not a workbook")
+            options["date_format"] = "MM/DD/YYYY"
+            with self.assertRaises(CommandError):
+                call_command("batch_parse", folder, stdout=io.StringIO(), **options)
+            stdout = io.StringIO()
+            options["date_format"] = "YYYY/MM/DD"
+            with self.assertRaises(CommandError):
+                call_command("batch_parse", folder, stdout=stdout, **options)
+            self.assertIn("Parsed 2 files (0 skipped, 1 failed)", stdout.getvalue())
+
+
+class DiskCacheTestCase(TestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = DiskCache(folder, max_bytes=250)
+
+            def write(content):
+                def writer(path):
+                    with open(path, "wb") as f:
+                        f.write(content)
+
+                return writer
+
+            cache.put("a", write(b"a" * 100))
+            cache.put("b", write(b"b" * 100))
+            os.utime(cache.entry_path("a"), (0, 0))
+            os.utime(cache.entry_path("b"), (1, 1))
+            self.assertIsNotNone(cache.get("a"))
+            cache.put("c", write(b"c" * 100))
+            self.assertIsNotNone(cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertIsNotNone(cache.get("c"))
+
+
+class OutputCacheTestCase(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        settings = override_settings(
+            PARSER_OUTPUT_CACHE_DIR=os.path.join(self.folder.name, "output"),
+            PARSER_OUTPUT_CACHE_BYTES=10**8,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.report = os.path.join(self.folder.name, "report.xlsx")
+        write_report(self.report, [report_row()])
+
+    def parse(self, output_date_format="DD/MM/YYYY", **kwargs):
+        output = io.BytesIO()
+        parser = parse_file(
+            self.report,
+            output,
+            "2020-01-01",
+            "2035-01-01",
+            "yes",
+            output_date_format,
+            "Last Date of Support",
+            **kwargs,
+        )
+        return parser, output.getvalue()
+
+    def test_identical_requests_are_served_from_the_cache(self):
+        first, content = self.parse()
+        self.assertEqual(first.stats["output_cache"], "miss")
+        self.assertIsNotNone(first.tables)
+        second, cached = self.parse()
+        self.assertEqual(second.stats["output_cache"], "hit")
+        self.assertEqual(cached, content)
+        self.assertIsNone(second.tables)
+        self.assertNotIn("load", second.stats["stages"])
+
+    def test_options_are_part_of_the_key(self):
+        self.parse()
+        parser, _ = self.parse(output_date_format="YYYY/MM/DD")
+        self.assertEqual(parser.stats["output_cache"], "miss")
+        parser, _ = self.parse(output_format="csv")
+        self.assertEqual(parser.stats["output_cache"], "miss")
+        write_report(self.report, [report_row(**{"Item Quantity": 2})])
+        parser, _ = self.parse()
+        self.assertEqual(parser.stats["output_cache"], "miss")
+
+    def test_parses_needing_the_tables_skip_the_cache(self):
+        self.parse()
+        parser, _ = self.parse(cache_output=False)
+        self.assertNotIn("output_cache", parser.stats)
+        self.assertIsNotNone(parser.tables)
+
+
+class JobViewTestCase(TestCase):
+    def create_job(self):
+        with open("media/test_files/empty.xlsb", "rb") as f:
+            data = {
+                "name": "test_file",
+                "file": f,
+                "start_date": "2000-01-01",
+                "end_date": "2100-01-01",
+                "include_minor_items": "yes",
+                "base_date_selection_on": "Last Date of Support",
+                "output_date_format": "DD/MM/YYYY",
+                "file_type": "single customer",
+            }
+            response = self.client.post(reverse("create_job"), data=data)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        self.addCleanup(shutil.rmtree, job_dir(job_id), True)
+        return response.json()
+
+    def wait_for_job(self, job):
+        for _ in range(600):
+            status = self.client.get(job["status_url"]).json()
+            if status["status"] in ("done", "failed", "cancelled"):
+                break
+            time.sleep(0.1)
+        return status
+
+    def test_job_runs_in_background_and_can_be_downloaded(self):
+        job = self.create_job()
+        status = self.wait_for_job(job)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["files"][0]["status"], "done")
+        response = self.client.get(job["download_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="test_file_parsed.xlsx"',
+        )
+
+    def test_progress_is_streamed_as_events(self):
+        job = self.create_job()
+        response = self.client.get(job["events_url"])
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = []
+        for message in b"".join(response.streaming_content).decode().split("\n\n"):
+            if message.startswith("event: "):
+                kind, data = message.split("\n", 1)
+                events.append((kind[len("event: "):], json.loads(data[len("data: "):])))
+        self.assertEqual(events[0][0], "file")
+        self.assertEqual(events[0][1]["name"], "test_file")
+        self.assertEqual(events[-1], ("job", {
+            "id": job["id"], "status": "done", "download_url": job["download_url"]
+        }))
+        last = events[-2][1]
+        self.assertEqual(last["stage"], "done")
+        self.assertEqual(last["input_rows"], 0)
+        response = self.client.get(last["download_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="test_file_parsed.xlsx"',
+        )
+
+    def test_file_download_waits_for_the_file(self):
+        job = self.create_job()
+        url = reverse("job_file", args=[job["id"], 0])
+        response = self.client.get(url)
+        if response.status_code == 409:
+            self.wait_for_job(job)
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("job_file", args=[job["id"], 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cancel_job(self):
+        job = self.create_job()
+        response = self.client.post(job["cancel_url"])
+        self.assertEqual(response.status_code, 202)
+        self.assertIn(response.json()["status"], ("cancelling", "cancelled", "done"))
+        self.assertIn(self.wait_for_job(job)["status"], ("cancelled", "done"))
+
+    def test_name_cannot_leave_the_job_folder(self):
+        escaped = os.path.join("media", "escaped")
+        self.addCleanup(lambda: os.path.exists(escaped) and os.remove(escaped))
+        for name in ["../../../escaped", "/tmp/escaped", ".."]:
+            with open("media/test_files/empty.xlsb", "rb") as f:
+                data = {
+                    "name": name,
+                    "file": f,
+                    "start_date": "2000-01-01",
+                    "end_date": "2100-01-01",
+                    "include_minor_items": "yes",
+                    "base_date_selection_on": "Last Date of Support",
+                    "output_date_format": "DD/MM/YYYY",
+                }
+                response = self.client.post(reverse("create_job"), data=data)
+            self.assertEqual(response.status_code, 400, name)
+        self.assertFalse(os.path.exists(escaped))
+        self.assertFalse(os.path.exists("/tmp/escaped"))
+
+    def test_jobs_left_running_by_a_dead_process_expire(self):
+        job = self.create_job()
+        self.wait_for_job(job)
+        state_path = os.path.join(job_dir(job["id"]), "job.json")
+        with open(state_path) as f:
+            state = json.load(f)
+        state["status"] = "running"
+        with open(state_path, "w") as f:
+            json.dump(state, f)
+        remove_expired_jobs()
+        self.assertTrue(os.path.exists(state_path))
+        stale = time.time() - 2 * 3600
+        os.utime(state_path, (stale, stale))
+        remove_expired_jobs()
+        self.assertFalse(os.path.exists(state_path))
+
+    def test_unknown_job_returns_404(self):
+        response = self.client.get(reverse("job_status", args=["0" * 32]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse("job_cancel", args=["..media"]))
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(job_dir("0" * 32 + "\n"))
+
+    def test_posts_without_csrf_token_are_rejected(self):
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(reverse("create_job"), data={})
+        self.assertEqual(response.status_code, 403)
+        response = client.post(reverse("job_cancel", args=["0" * 32]))
+        self.assertEqual(response.status_code, 403)
+
+
+class WorkerPoolTestCase(TestCase):
+    def test_workers_are_reused_between_jobs(self):
+        pool = WorkerPool(max_workers=1, max_pending=1)
+        self.addCleanup(pool.shutdown)
+        pids = [future.result() for future in pool.as_completed(os.getpid, [()] * 3)]
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(len(set(pids)), 1)
+
+    def test_workers_start_with_the_parser_imported(self):
+        pool = WorkerPool(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        pool.warm_up()
+        loaded = pool.submit(eval, "'pandas' in __import__('sys').modules").result()
+        self.assertTrue(loaded)
+
+    def test_url_conf_does_not_import_pandas(self):
+        code = (
+            "import sys, django; django.setup(); import Cisco_Ready_Parser.urls; "
+            "print(sorted({'pandas', 'openpyxl', 'numpy'} & set(sys.modules)))"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="Cisco_Ready_Parser.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_uploads_do_not_import_pandas(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        paths = []
+        for name in ["first.xlsx", "second.xlsx"]:
+            paths.append(os.path.join(folder, name))
+            write_report(paths[-1], [report_row(**{"Item Quantity": 2})])
+        code = """
+import io, sys, zipfile, django
+django.setup()
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+setup_test_environment()
+options = {
+    "start_date": "2000-01-01",
+    "end_date": "2100-01-01",
+    "include_minor_items": "yes",
+    "base_date_selection_on": "Last Date of Support",
+    "output_date_format": "DD/MM/YYYY",
+}
+client = Client()
+with open(sys.argv[1], "rb") as f:
+    data = dict(options, name="first", file=f, file_type="single customer")
+    response = client.post(reverse("upload_file"), data=data)
+assert response.status_code == 200, response.status_code
+files = [open(path, "rb") for path in sys.argv[1:]]
+data = dict(options, files=files, consolidate="yes")
+response = client.post(reverse("upload_folder"), data=data)
+archive = zipfile.ZipFile(io.BytesIO(b"".join(response)))
+assert "consolidated_parsed.xlsx" in archive.namelist(), archive.namelist()
+print(sorted({"pandas", "openpyxl", "numpy"} & set(sys.modules)))
+"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="Cisco_Ready_Parser.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", code, *paths],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        self.assertEqual(output.strip().splitlines()[-1], "[]")
+
+
+class FolderViewTestCase(TestCase):
+    def test_post_request_streams_zip_with_timings(self):
+        with open("media/test_files/empty.xlsb", "rb") as f:
+            content = f.read()
+        files = []
+        for name in ["first.xlsb", "second.xlsb"]:
+            upload = io.BytesIO(content)
+            upload.name = name
+            files.append(upload)
+        data = {
+            "files": files,
+            "start_date": "2000-01-01",
+            "end_date": "2100-01-01",
+            "include_minor_items": "yes",
+            "base_date_selection_on": "Last Date of Support",
+            "output_date_format": "DD/MM/YYYY",
+        }
+        response = self.client.post(reverse("upload_folder"), data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response)))
+        self.assertEqual(
+            sorted(archive.namelist()), ["first_parsed.xlsx", "second_parsed.xlsx"]
+        )
+        for info in archive.infolist():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            self.assertTrue(info.comment.startswith(b"parsed in "))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(os.listdir(SCRATCH_PATH), [])
+
+    def test_concurrent_requests_keep_their_files(self):
+        with open("media/test_files/empty.xlsb", "rb") as f:
+            content = f.read()
+        responses = []
+        for name in ["first.xlsb", "second.xlsb"]:
+            upload = io.BytesIO(content)
+            upload.name = name
+            data = {
+                "files": [upload],
+                "start_date": "2000-01-01",
+                "end_date": "2100-01-01",
+                "include_minor_items": "yes",
+                "base_date_selection_on": "Last Date of Support",
+                "output_date_format": "DD/MM/YYYY",
+            }
+            responses.append(self.client.post(reverse("upload_folder"), data=data))
+        # the second request finishes and cleans up before the first one starts
+        second = zipfile.ZipFile(io.BytesIO(b"".join(responses[1])))
+        first = zipfile.ZipFile(io.BytesIO(b"".join(responses[0])))
+        self.assertEqual(first.namelist(), ["first_parsed.xlsx"])
+        self.assertEqual(second.namelist(), ["second_parsed.xlsx"])
+        self.assertEqual(os.listdir(SCRATCH_PATH), [])
+
+    def test_post_request_adds_consolidated_workbook(self):
+        files = []
+        for name in ["first.xlsx", "second.xlsx"]:
+            upload = io.BytesIO()
+            workbook_path = os.path.join(tempfile.mkdtemp(), name)
+            self.addCleanup(shutil.rmtree, os.path.dirname(workbook_path))
+            write_report(workbook_path, [report_row(**{"Item Quantity": 2})])
+            with open(workbook_path, "rb") as f:
+                upload.write(f.read())
+            upload.seek(0)
+            upload.name = name
+            files.append(upload)
+        data = {
+            "files": files,
+            "start_date": "2000-01-01",
+            "end_date": "2100-01-01",
+            "include_minor_items": "yes",
+            "base_date_selection_on": "Last Date of Support",
+            "output_date_format": "DD/MM/YYYY",
+            "consolidate": "yes",
+        }
+        response = self.client.post(reverse("upload_folder"), data=data)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response)))
+        self.assertEqual(archive.namelist()[-1], "consolidated_parsed.xlsx")
+        worksheet = load_workbook(
+            io.BytesIO(archive.read("consolidated_parsed.xlsx"))
+        )["LDoS"]
+        self.assertEqual(worksheet["A2"].value, "Enterprise Switching")
+        self.assertEqual(worksheet["A3"].value, 4)
+
+
 class FileViewTestCase(TestCase):
     def test_get_request(self):
         response = self.client.get(reverse("upload_file"))
@@ -86,6 +1350,109 @@ class FileViewTestCase(TestCase):
                     )
                     f.close()
 
+    def post_report(self):
+        # the parse runs on a pool worker, which does not see override_settings,
+        # a serial number of its own keeps the report out of the output cache
+        serial = {"Serial Number / PAK number": f"FOC{random.getrandbits(64)}"}
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(
+                path, [report_row(**serial), report_row(**{"Item Quantity": 4})]
+            )
+            with open(path, "rb") as f:
+                data = {
+                    "name": "report",
+                    "file": f,
+                    "start_date": "2000-01-01",
+                    "end_date": "2100-01-01",
+                    "include_minor_items": "yes",
+                    "base_date_selection_on": "Last Date of Support",
+                    "output_date_format": "DD/MM/YYYY",
+                    "file_type": "single customer",
+                }
+                response = self.client.post(reverse("upload_file"), data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(os.listdir(SCRATCH_PATH), [])
+        worksheet = load_workbook(io.BytesIO(b"".join(response)))["LDoS"]
+        self.assertEqual(worksheet["A2"].value, "Enterprise Switching")
+        self.assertEqual(worksheet["A3"].value, 5)
+
+    def test_post_request_parses_upload_in_memory(self):
+        self.post_report()
+
+    def test_post_request_returns_csv(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(path, [report_row()])
+            with open(path, "rb") as f:
+                data = {
+                    "name": "report",
+                    "file": f,
+                    "start_date": "2000-01-01",
+                    "end_date": "2100-01-01",
+                    "include_minor_items": "yes",
+                    "base_date_selection_on": "Last Date of Support",
+                    "output_date_format": "DD/MM/YYYY",
+                    "file_type": "single customer",
+                    "output_format": "csv",
+                }
+                response = self.client.post(reverse("upload_file"), data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("report_parsed.csv", response["Content-Disposition"])
+        lines = b"".join(response).decode().splitlines()
+        self.assertEqual(
+            lines[0],
+            "Sheet,Portfolio,Quantity,Coverage,Product ID,Product Description,Date,Major/Minor",
+        )
+        self.assertEqual(
+            lines[1],
+            "LDoS,Enterprise Switching,1,COVERED,C9300-48P,Catalyst 9300 48-port PoE+,01/01/2030,Major",
+        )
+
+    def test_post_request_adds_changes_report(self):
+        # the snapshot is stored by a pool worker, which does not see
+        # override_settings, so the customer gets a name of its own
+        name = f"report{random.getrandbits(64)}"
+        key = snapshot_key(name, "Last Date of Support", "yes", "single customer")
+        snapshot = os.path.join(snapshots_path(), f"{key}.feather")
+        self.addCleanup(lambda: os.path.exists(snapshot) and os.remove(snapshot))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "report.xlsx")
+            write_report(path, [report_row()])
+            with open(path, "rb") as f:
+                data = {
+                    "name": name,
+                    "file": f,
+                    "start_date": "2000-01-01",
+                    "end_date": "2100-01-01",
+                    "include_minor_items": "yes",
+                    "base_date_selection_on": "Last Date of Support",
+                    "output_date_format": "DD/MM/YYYY",
+                    "file_type": "single customer",
+                    "changes_report": "yes",
+                }
+                response = self.client.post(reverse("upload_file"), data=data)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(
+                archive.namelist(), [f"{name}_parsed.xlsx", f"{name}_changes.xlsx"]
+            )
+            changes = load_workbook(io.BytesIO(archive.read(f"{name}_changes.xlsx")))
+        self.assertEqual(changes["New"]["C3"].value, "C9300-48P")
+
+    def test_parse_is_exposed_as_metrics(self):
+        self.post_report()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('parser_parses_total{outcome="done",source="single-file"}', content)
+        self.assertIn('parser_stage_seconds_count{stage="write_LDoS"}', content)
+        self.assertIn("parser_peak_memory_bytes", content)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_post_request_parses_spooled_upload(self):
+        self.post_report()
+
     def test_post_request_invalid_date_for_single_file(self):
         # lower bound outside range
         # upper bound outside range
@@ -1,6 +1,30 @@
+import io
+import json
 import os
+import pickle
+import time
+from collections import namedtuple
 
-from .parser import Parser
+from .cache import input_cache, output_cache
+from .file_handler import changes_file_name, parsed_file_name
+from .worker_pool import get_sheet_pool
+
+# Arguments of threading_for_folder for one file of a folder upload.
+FolderJob = namedtuple(
+    "FolderJob",
+    [
+        "scratch_dir",
+        "name",
+        "start_date",
+        "end_date",
+        "include_minor_items",
+        "output_date_format",
+        "selected_date_target",
+        "consolidate",
+        "output_format",
+        "changes_report",
+    ],
+)
 
 
 def parse_file(
@@ -12,13 +36,19 @@ def parse_file(
     output_date_format,
     selected_date_target,
     file_type="single customer",
+    cancel_event=None,
+    output_format="xlsx",
+    chunk_rows=None,
+    cache_output=True,
+    progress=None,
+    sheet_pool=None,
 ):
     """
     Description: Function used by Django views to pass form parameters to the Parser object.
 
     Args:
-        file_to_parse (str): Path to file that we want to process.
-        output (str): Path where the resulting file is written to.
+        file_to_parse (str|file): Path to, or binary file object of, the file that we want to process.
+        output (str|file): Path or writable binary file object the resulting file is written to.
         start_date (str): Lower end of the date filter done by the Parser object.
         end_date (str): Higher end of the date fitler done by the Parser object.
         include_minor_items (str): yes/no value that decides whether we include Minor items.
@@ -26,7 +56,30 @@ def parse_file(
                                            \'End of Software Maintenance Date\',
                                            \'End of Product Sale Date\',
                                            \'Last Renewal Date\'
+        cancel_event (object): Optional event, the parse is aborted once its is_set() returns True.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        chunk_rows (int): Rows read and aggregated at a time, 0 reads the whole file at once.
+                          Defaults to the PARSER_CHUNK_ROWS setting.
+        cache_output (bool): Answer from, and store into, the output cache. Outputs served
+                             from the cache have no aggregated tables, so callers that use
+                             them turn it off.
+        progress (callable): Optional, called with the stage of the parse, see ProgressFile.
+        sheet_pool (WorkerPool): Pool the sheets of large xlsx outputs are rendered on
+                                 in parallel, defaults to worker_pool.get_sheet_pool.
+
+    Returns:
+        Parser: The finished Parser, with the stats and the aggregated tables of the parse.
     """
+    # imported here so the web process can import this module without pandas,
+    # the pool workers have it preloaded
+    from .parser import Parser
+
+    if chunk_rows is None:
+        from django.conf import settings
+
+        chunk_rows = getattr(settings, "PARSER_CHUNK_ROWS", 0)
+    if sheet_pool is None:
+        sheet_pool = get_sheet_pool()
     parser = Parser(
         file_to_parse,
         output,
@@ -36,16 +89,34 @@ def parse_file(
         output_date_format,
         selected_date_target,
         file_type,
+        cancel_event=cancel_event,
+        input_cache=input_cache(),
+        output_format=output_format,
+        chunk_rows=chunk_rows or None,
+        output_cache=output_cache() if cache_output else None,
+        progress=progress,
+        sheet_pool=sheet_pool,
     )
+    return parser
 
 def threading_for_folder(
-    name, start_date, end_date, include_minor_items, output_date_format, selected_date_target, 
+    scratch_dir,
+    name,
+    start_date,
+    end_date,
+    include_minor_items,
+    output_date_format,
+    selected_date_target,
+    consolidate="no",
+    output_format="xlsx",
+    changes_report="no",
 ):
     """
     Description: Function used by the Django views, upload_folder, as it uses multiprocessing.
                  Passes values from the upload_folder view to the parse_file function.
 
     Args:
+        scratch_dir (str): Scratch folder of the request, see file_handler.create_scratch_dir.
         name (str): Name of the file to process with the Parser object.
         start_date (str): Lower end of the date filter done by the Parser object.
         end_date (str): Higher end of the date fitler done by the Parser object.
@@ -55,14 +126,248 @@ def threading_for_folder(
                                            \'End of Product Sale Date\',
                                            \'Last Renewal Date\'
         output_date_format (str): describes the format to be used for dates
+        consolidate (str): yes/no value, on yes the aggregated tables are saved in the
+                           scratch folder too, so a consolidated workbook can be built
+                           from them, see threading_for_consolidation.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        changes_report (str): yes/no value, on yes a workbook of what changed since the
+                              previous run of the same file name is written too.
+
+    Returns:
+        dict: The file name, the path of the parsed file, the wall time in seconds,
+              the stats of the parse, when consolidating the path of the aggregated
+              tables and, when requested, the path of the changes workbook.
     """
 
-    unparsed_path = os.path.join("media", "unparsed")
-    parsed_path = os.path.join("media", "parsed")
+    unparsed_path = os.path.join(scratch_dir, "unparsed")
+    parsed_path = os.path.join(scratch_dir, "parsed")
     unparsed_file_path = os.path.join(unparsed_path, name)
-    parsed_file_path = f"{parsed_path}/{name}_parsed.xlsx"
+    parsed_file_path = f"{parsed_path}/{parsed_file_name(name, output_format)}"
     print(parsed_file_path)
-    parse_file(
+    start_time = time.time()
+    parser = parse_file(
+        unparsed_file_path,
+        parsed_file_path,
+        start_date,
+        end_date,
+        include_minor_items,
+        output_date_format,
+        selected_date_target,
+        output_format=output_format,
+        cache_output=consolidate != "yes" and changes_report != "yes",
+    )
+    changes_path = None
+    if changes_report == "yes":
+        from .snapshots import record_changes
+
+        changes_path = os.path.join(parsed_path, changes_file_name(name))
+        record_changes(parser, name, changes_path)
+    tables_path = None
+    if consolidate == "yes":
+        # pickled to disk rather than returned, unpickling the DataFrames would
+        # import pandas in the web process
+        os.makedirs(os.path.join(scratch_dir, "tables"), exist_ok=True)
+        tables_path = os.path.join(scratch_dir, "tables", f"{name}.pickle")
+        with open(tables_path, "wb") as f:
+            pickle.dump(parser.tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return {
+        "name": name,
+        "output": parsed_file_path,
+        "seconds": time.time() - start_time,
+        "stats": parser.stats,
+        "tables": tables_path,
+        "changes": changes_path,
+    }
+
+
+def threading_for_consolidation(
+    tables_paths,
+    output,
+    output_date_format,
+    selected_date_target,
+    output_format="xlsx",
+):
+    """
+    Description: Function used by the Django views, upload_folder, runs in a worker of the pool.
+                 Writes one workbook consolidating the files of a folder upload.
+
+    Args:
+        tables_paths (list): Aggregated tables saved by threading_for_folder, in upload order.
+        output (str): Path where the consolidated file is written to.
+        output_date_format (str): describes the format to be used for dates
+        selected_date_target (str): Date column the files were aggregated on.
+        output_format (str): xlsx, csv, jsonl or parquet.
+    """
+    from .parser import write_consolidated_report
+
+    partials = []
+    for path in tables_paths:
+        with open(path, "rb") as f:
+            partials.append(pickle.load(f))
+    write_consolidated_report(
+        partials,
+        output,
+        output_date_format,
+        selected_date_target,
+        output_format=output_format,
+        sheet_pool=get_sheet_pool(),
+    )
+
+
+def threading_for_upload(
+    file_to_parse,
+    name,
+    start_date,
+    end_date,
+    include_minor_items,
+    output_date_format,
+    selected_date_target,
+    file_type,
+    output_format="xlsx",
+    changes_report="no",
+):
+    """
+    Description: Function used by the Django views, upload_file, runs in a worker of the pool
+                 so the web process never imports pandas. The parsed file is written
+                 to memory and returned to the view.
+
+    Args:
+        file_to_parse (str|bytes): Path to the uploaded file, or its content,
+                                   see file_handler.uploaded_file_source.
+        name (str): Name of the upload, the customer of the changes report.
+        start_date (str): Lower end of the date filter done by the Parser object.
+        end_date (str): Higher end of the date fitler done by the Parser object.
+        include_minor_items (str): yes/no value that decides whether we include Minor items.
+        output_date_format (str): describes the format to be used for dates
+        selected_date_target (str): Date column the date filter is applied to.
+        file_type (str): single customer or multiple customers.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        changes_report (str): yes/no value, on yes a workbook of what changed since the
+                              previous run of the same name is returned too.
+
+    Returns:
+        dict: The parsed file, the wall time in seconds, the stats of the parse and,
+              when requested, the changes workbook. Files are returned as bytes.
+    """
+    if isinstance(file_to_parse, bytes):
+        file_to_parse = io.BytesIO(file_to_parse)
+    output = io.BytesIO()
+    start_time = time.time()
+    parser = parse_file(
+        file_to_parse,
+        output,
+        start_date,
+        end_date,
+        include_minor_items,
+        output_date_format,
+        selected_date_target,
+        file_type,
+        output_format=output_format,
+        cache_output=changes_report != "yes",
+    )
+    changes = None
+    if changes_report == "yes":
+        from .snapshots import record_changes
+
+        changes = io.BytesIO()
+        record_changes(parser, name, changes)
+        changes = changes.getvalue()
+    return {
+        "output": output.getvalue(),
+        "seconds": time.time() - start_time,
+        "stats": parser.stats,
+        "changes": changes,
+    }
+
+
+class CancelMarker:
+    """
+    Description: Cancel event backed by a marker file, so it can be shared with
+                 pool workers in other processes. It is set once the file exists.
+
+    Args:
+        path (str): Path of the marker file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def is_set(self):
+        return os.path.exists(self.path)
+
+    def set(self):
+        with open(self.path, "w"):
+            pass
+
+
+class ProgressFile:
+    """
+    Description: Progress callback of a Parser backed by a JSON file, so the web process
+                 can follow a parse running in a pool worker. Every call replaces the
+                 file with the stage, its details and the seconds since the start.
+
+    Args:
+        path (str): Path of the progress file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+
+    def __call__(self, stage, **info):
+        info["stage"] = stage
+        info["elapsed"] = time.time() - self.start
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.path)
+
+    def read(self):
+        """
+        Description: The last progress written, None before the first one.
+        """
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+def threading_for_job(
+    unparsed_file_path,
+    parsed_file_path,
+    start_date,
+    end_date,
+    include_minor_items,
+    output_date_format,
+    selected_date_target,
+    file_type,
+    cancel_path,
+    output_format="xlsx",
+    progress_path=None,
+):
+    """
+    Description: Function used by the parse jobs, runs in a worker of the pool.
+                 Passes values from the job to the parse_file function.
+
+    Args:
+        unparsed_file_path (str): Path to the uploaded file.
+        parsed_file_path (str): Path where the resulting file is written to.
+        start_date (str): Lower end of the date filter done by the Parser object.
+        end_date (str): Higher end of the date fitler done by the Parser object.
+        include_minor_items (str): yes/no value that decides whether we include Minor items.
+        output_date_format (str): describes the format to be used for dates
+        selected_date_target (str): Date column the date filter is applied to.
+        file_type (str): single customer or multiple customers.
+        cancel_path (str): Marker file, the parse stops once it exists.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        progress_path (str): Optional file the progress of the parse is written to.
+
+    Returns:
+        dict: The path of the parsed file, the wall time in seconds and the stats of the parse.
+    """
+    start_time = time.time()
+    parser = parse_file(
         unparsed_file_path,
         parsed_file_path,
         start_date,
@@ -70,4 +375,75 @@ def threading_for_folder(
         include_minor_items,
         output_date_format,
         selected_date_target,
+        file_type,
+        cancel_event=CancelMarker(cancel_path),
+        output_format=output_format,
+        progress=ProgressFile(progress_path) if progress_path else None,
     )
+    return {
+        "output": parsed_file_path,
+        "seconds": time.time() - start_time,
+        "stats": parser.stats,
+    }
+
+
+def threading_for_batch(
+    input_path,
+    output_path,
+    start_date,
+    end_date,
+    include_minor_items,
+    output_date_format,
+    selected_date_target,
+    file_type,
+    output_format="xlsx",
+    chunk_rows=None,
+):
+    """
+    Description: Function used by the batch_parse command, runs in a worker of the pool.
+                 The result is written next to output_path first and moved into place
+                 once complete, so an interrupted run never leaves a partial output
+                 that would look up to date.
+
+    Args:
+        input_path (str): Path to the report to parse.
+        output_path (str): Path where the resulting file is written to.
+        start_date (str): Lower end of the date filter done by the Parser object.
+        end_date (str): Higher end of the date fitler done by the Parser object.
+        include_minor_items (str): yes/no value that decides whether we include Minor items.
+        output_date_format (str): describes the format to be used for dates
+        selected_date_target (str): Date column the date filter is applied to.
+        file_type (str): single customer or multiple customers.
+        output_format (str): xlsx, csv, jsonl or parquet.
+        chunk_rows (int): Rows read and aggregated at a time, see parse_file.
+
+    Returns:
+        dict: The input and output paths, the wall time in seconds and the stats of the parse.
+    """
+    start_time = time.time()
+    tmp_path = f"{output_path}.tmp"
+    try:
+        parser = parse_file(
+            input_path,
+            tmp_path,
+            start_date,
+            end_date,
+            include_minor_items,
+            output_date_format,
+            selected_date_target,
+            file_type,
+            output_format=output_format,
+            chunk_rows=chunk_rows,
+        )
+        os.replace(tmp_path, output_path)
+    except Exception as error:
+        raise RuntimeError(f"{input_path}: {error}") from error
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {
+        "input": input_path,
+        "output": output_path,
+        "seconds": time.time() - start_time,
+        "stats": parser.stats,
+    }
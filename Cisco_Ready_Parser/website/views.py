@@ -1,18 +1,38 @@
 from django.shortcuts import render, redirect
 from .forms import UploadFileForm, UploadFolderForm
-from django.http import FileResponse, HttpResponse, JsonResponse
-import os, io, zipfile
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.urls import reverse
+import os, io
 import datetime
+import json
 import pathlib
 import time
-import multiprocessing
 
 from .file_handler import *
-from .threading_handle import threading_for_folder, parse_file
+from .file_handler import OUTPUT_FORMATS
+from .threading_handle import (
+    FolderJob,
+    threading_for_consolidation,
+    threading_for_folder,
+    threading_for_upload,
+)
 from .error_messages import INVALID_DATE
+from .jobs import FINAL_STATES, cancel_job, create_job, get_job, job_dir
+from . import metrics
+from .worker_pool import get_pool
+from .zip_stream import stream_zip
 
 DIR = f"{str(pathlib.Path().resolve())}"
-create_folders_for_uploaded_files()
+CONSOLIDATED_NAME = "consolidated"
+# Seconds between two looks at the state of a job whose progress is being streamed,
+# and between two keep-alive comments while nothing changes.
+EVENT_INTERVAL = 0.5
+KEEPALIVE_INTERVAL = 15
 
 
 def download_file(file_path, file_name):
@@ -36,27 +56,121 @@ def download_file(file_path, file_name):
     return response
 
 
-def download_folder():
+def download_buffer(buffer, file_name):
     """
-    Description: Downloads a folder as a zip file and returns it as a Django HTTP response.
+    Description: Returns an in-memory file as a Django HTTP response.
+
+    Args:
+        buffer (io.BytesIO): The content to be downloaded.
+        file_name (str): The name of the file.
 
     Returns:
-        HttpResponse: An HTTP response containing the zip file to be downloaded.
+        FileResponse: An HTTP response containing the file to be downloaded.
     """
-    folder_path = "media/parsed"  # Replace with the path to your folder
-    file_list = os.listdir(folder_path)
+    buffer.seek(0)
+    response = FileResponse(buffer)
+    response["Content-Type"] = "application/octet-stream"
+    response["Content-Disposition"] = f'attachment; filename="{file_name}"'
+    return response
+
 
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for f in file_list:
-            file_path = os.path.join(folder_path, f)
-            zf.write(file_path, f)
+def download_zip(entries):
+    """
+    Description: Streams a zip archive of the given files as a Django HTTP response.
 
-    response = HttpResponse(buffer.getvalue(), content_type="application/zip")
+    Args:
+        entries (iterable): Files to add, see zip_stream.stream_zip.
+
+    Returns:
+        StreamingHttpResponse: An HTTP response streaming the zip file to be downloaded.
+    """
+    response = StreamingHttpResponse(
+        stream_zip(entries), content_type="application/zip"
+    )
     response["Content-Disposition"] = "attachment; filename=download.zip"
     return response
 
 
+def download_folder(folder_path):
+    """
+    Description: Downloads a folder as a zip file and returns it as a Django HTTP response.
+
+    Args:
+        folder_path (str): The folder to zip.
+
+    Returns:
+        StreamingHttpResponse: An HTTP response streaming the zip file to be downloaded.
+    """
+    file_list = os.listdir(folder_path)
+    return download_zip((os.path.join(folder_path, f), f) for f in file_list)
+
+
+def parsed_folder_files(jobs, start_timer, scratch_dir, consolidate=False):
+    """
+    Description: Parses the files of a folder upload on the worker pool and yields each
+                 parsed file as soon as it is ready, so the zip can be streamed while
+                 the other files are still being parsed. The parse time of each file
+                 is stored in the comment of its zip entry.
+                 When consolidating, the workers also save their aggregated tables,
+                 which a worker merges into one more workbook once every file is parsed.
+                 Changes workbooks written by the workers follow their parsed file.
+                 The scratch folder of the request is removed once all files are sent.
+
+    Args:
+        jobs (list): FolderJob arguments of threading_for_folder, one per file.
+        start_timer (float): Time the request started.
+        scratch_dir (str): Scratch folder holding the uploaded and parsed files.
+        consolidate (bool): Also yield a workbook consolidating every file.
+
+    Yields:
+        tuple: Path, name in the archive and comment of a parsed file.
+    """
+    order = {job.name: index for index, job in enumerate(jobs)}
+    partials = {}
+    try:
+        for future in get_pool().as_completed(threading_for_folder, jobs):
+            try:
+                result = future.result()
+            except Exception as error:
+                print(f"MAIN: failed to parse a file: {error}")
+                metrics.record_outcome("multi-file", "failed")
+                continue
+            print(f"MAIN: {result['name']} took {result['seconds']} seconds")
+            metrics.record_parse(result["stats"], result["seconds"], "multi-file")
+            if consolidate:
+                partials[order[result["name"]]] = result["tables"]
+            yield (
+                result["output"],
+                os.path.basename(result["output"]),
+                f"parsed in {result['seconds']:.3f} seconds",
+            )
+            if result["changes"] is not None:
+                yield (result["changes"], os.path.basename(result["changes"]))
+        if partials:
+            consolidate_start = time.time()
+            output_format = jobs[0].output_format
+            output_name = parsed_file_name(CONSOLIDATED_NAME, output_format)
+            output = os.path.join(scratch_dir, "parsed", output_name)
+            # the reduce keeps the upload order, whatever order the files finished in
+            get_pool().submit(
+                threading_for_consolidation,
+                [partials[index] for index in sorted(partials)],
+                output,
+                jobs[0].output_date_format,
+                jobs[0].selected_date_target,
+                output_format,
+            ).result()
+            yield (
+                output,
+                output_name,
+                f"consolidated {len(partials)} files in "
+                f"{time.time() - consolidate_start:.3f} seconds",
+            )
+        print(time.time() - start_timer)
+    finally:
+        remove_scratch_dir(scratch_dir)
+
+
 def date_interval_is_valid(start_date, end_date):
     """
     Description: Checks if the given start and end dates fall within a valid range.
@@ -111,6 +225,9 @@ def upload_file(request):
         end_date (DateField): The end date for the date range to filter data by.
         include_minor_items (ChoiceField): A flag to indicate whether or not to include minor items in the parsed data.
         base_date_selection_on (ChoiceField): The criteria for selecting the date field to filer for.
+        output_format (ChoiceField): xlsx workbook, or the same data as csv, jsonl or parquet.
+        changes_report (ChoiceField): A flag to also return what changed since the previous run
+                                      of the same name, the response is then a zip file.
 
     """
     form = UploadFileForm()
@@ -124,33 +241,46 @@ def upload_file(request):
         selected_date_target = request.POST["base_date_selection_on"]
         output_date_format = request.POST["output_date_format"]
         file_type = request.POST["file_type"]
+        output_format = request.POST.get("output_format") or "xlsx"
+        changes_report = request.POST.get("changes_report") or "no"
 
+        if output_format not in OUTPUT_FORMATS:
+            context = {
+                "form": form,
+                "error_message": f"Unknown output format {output_format}",
+            }
+            return render(request, "website/upload_file.html", context, status=400)
         if date_interval_is_valid(start_date, end_date):
             if name == "":
                 name = format_file_name(file)
 
-            path_and_extension = f"media/unparsed/{name}.xlsb"
-            output_name = f"media/parsed/{name}_parsed.xlsx"
-            handle_uploaded_file(file, path_and_extension)
+            output_name = parsed_file_name(name, output_format)
             print("Reading the file")
             start_time = time.time()
-            parse_file(
-                path_and_extension,
-                output_name,
+            result = get_pool().submit(
+                threading_for_upload,
+                uploaded_file_source(file),
+                name,
                 start_date,
                 end_date,
                 include_minor_items,
                 output_date_format,
                 selected_date_target,
                 file_type,
-            )
+                output_format,
+                changes_report,
+            ).result()
             end_time = time.time()
             print("Finished reading the file")
             print(f"Took {end_time - start_time} seconds")
-            output_name = f"{DIR}/{output_name}"
-            build_download_file = download_file(output_name, output_name)
-            remove_files()
-            return build_download_file
+            metrics.record_parse(result["stats"], end_time - start_time, "single-file")
+            output = io.BytesIO(result["output"])
+            if result["changes"] is not None:
+                changes = io.BytesIO(result["changes"])
+                return download_zip(
+                    [(output, output_name), (changes, changes_file_name(name))]
+                )
+            return download_buffer(output, output_name)
         else:
             error_message = INVALID_DATE.format(start_date, end_date)
             context = {"form": form, "error_message": error_message}
@@ -194,6 +324,10 @@ def upload_folder(request):
         end_date (DateField): The end date for the date range to filter data by.
         include_minor_items (ChoideField): A flag to indicate whether or not to include minor items in the parsed data.
         base_date_selection_on (ChoiceField): The criteria for selecting the date field to filer for.
+        output_format (ChoiceField): xlsx workbook, or the same data as csv, jsonl or parquet.
+        changes_report (ChoiceField): A flag to also return what changed since the previous run
+                                      of the same name, the response is then a zip file.
+        consolidate (ChoiceField): A flag to also return one workbook consolidating every file.
     """
 
     form = UploadFolderForm()
@@ -205,44 +339,44 @@ def upload_folder(request):
         include_minor_items = request.POST["include_minor_items"]
         selected_date_target = request.POST["base_date_selection_on"]
         output_date_format = request.POST["output_date_format"]
+        consolidate = request.POST.get("consolidate", "no")
+        output_format = request.POST.get("output_format") or "xlsx"
+        changes_report = request.POST.get("changes_report") or "no"
 
+        if output_format not in OUTPUT_FORMATS:
+            context = {
+                "form": form,
+                "error_message": f"Unknown output format {output_format}",
+            }
+            return render(request, "website/upload_folder.html", context, status=400)
         if date_interval_is_valid(start_date, end_date):
-            threads = []
-
+            jobs = []
             start_timer = time.time()
-            for index, file in enumerate(folder):
-                print(f"MAIN: Create and start thread {index}")
-
+            scratch_dir = create_scratch_dir()
+            for file in folder:
                 name = format_file_name(file)
-                unparsed_path = os.path.join("media", "unparsed")
-                parsed_path = os.path.join("media", "parsed")
-                unparsed_file_path = os.path.join(unparsed_path, name)
-                parsed_file_path = f"{parsed_path}/{name}_parsed.xlsx"
+                unparsed_file_path = os.path.join(scratch_dir, "unparsed", name)
                 handle_uploaded_file(file, unparsed_file_path)
-
-                process = multiprocessing.Process(
-                    target=threading_for_folder,
-                    args=(
+                jobs.append(
+                    FolderJob(
+                        scratch_dir,
                         name,
                         start_date,
                         end_date,
                         include_minor_items,
                         output_date_format,
                         selected_date_target,
-                    ),
+                        consolidate,
+                        output_format,
+                        changes_report,
+                    )
+                )
+
+            return download_zip(
+                parsed_folder_files(
+                    jobs, start_timer, scratch_dir, consolidate == "yes"
                 )
-                threads.append(process)
-                process.start()
-            for index, thread in enumerate(threads):
-                print(f"MAIN: before joining thread {index}")
-                thread.join()
-                print(f"MAIN: thread {index} is finished")
-            end_timer = time.time()
-            diff = end_timer - start_timer
-            print(diff)
-            build_download_file = download_folder()
-            remove_files()
-            return build_download_file
+            )
         else:
             error_message = INVALID_DATE.format(start_date, end_date)
             context = {"form": form, "error_message": error_message}
@@ -256,3 +390,235 @@ def upload_folder(request):
             "form": form,
         }
         return render(request, "website/upload_folder.html", context, status=400)
+
+
+def job_response(state, status=200):
+    """
+    Description: Serializes the state of a parse job together with the URLs to follow it.
+
+    Args:
+        state (dict): The state of the job.
+        status (int): HTTP status code of the response.
+
+    Returns:
+        JsonResponse: The state of the job.
+    """
+    job_id = state["id"]
+    data = dict(state)
+    data.pop("options", None)
+    data["files"] = [
+        file_progress(job_id, index, entry) for index, entry in enumerate(state["files"])
+    ]
+    data["status_url"] = reverse("job_status", args=[job_id])
+    data["events_url"] = reverse("job_events", args=[job_id])
+    data["download_url"] = reverse("job_download", args=[job_id])
+    data["cancel_url"] = reverse("job_cancel", args=[job_id])
+    return JsonResponse(data, status=status)
+
+
+def file_progress(job_id, index, entry):
+    """
+    Description: The state of one file of a job, with the URL to download it once it is parsed.
+
+    Args:
+        job_id (str): ID of the job.
+        index (int): Position of the file in the job.
+        entry (dict): The state of the file.
+
+    Returns:
+        dict: The state of the file.
+    """
+    data = dict(entry, index=index)
+    if entry["status"] == "done":
+        data["download_url"] = reverse("job_file", args=[job_id, index])
+    return data
+
+
+def job_event_stream(job_id):
+    """
+    Description: Server-sent events following a job. A "file" event carries the state of
+                 a file each time it changes, see file_progress, starting with every file.
+                 A last "job" event carries the final status of the job and the URL to
+                 download all its files, then the stream ends.
+
+    Args:
+        job_id (str): ID of the job.
+
+    Yields:
+        str: The next event.
+    """
+    sent = {}
+    last_event = time.time()
+    while True:
+        state = get_job(job_id)
+        if state is None:
+            return
+        for index, entry in enumerate(state["files"]):
+            data = file_progress(job_id, index, entry)
+            if sent.get(index) != data:
+                sent[index] = data
+                last_event = time.time()
+                yield f"event: file\ndata: {json.dumps(data)}\n\n"
+        if state["status"] in FINAL_STATES:
+            data = {"id": job_id, "status": state["status"]}
+            if state["status"] == "done":
+                data["download_url"] = reverse("job_download", args=[job_id])
+            yield f"event: job\ndata: {json.dumps(data)}\n\n"
+            return
+        if time.time() - last_event > KEEPALIVE_INTERVAL:
+            last_event = time.time()
+            yield ": keep-alive\n\n"
+        time.sleep(EVENT_INTERVAL)
+
+
+def create_parse_job(request):
+    """
+    Description: Starts a parse job and returns its ID immediately. The parse runs
+                 in the background, use the returned URLs to follow, download or cancel it.
+
+    Parameters:
+        request (HttpRequest): The HTTP request object that contains information about the request.
+
+    Returns:
+        JsonResponse: The state of the new job with status 202, or an error with status 400.
+
+    Form Fields:
+        file (FileField): A single file to be parsed, or
+        files (FileField): The list of files to be parsed.
+        name (CharField): Optional output name when a single file is uploaded, a plain
+                          file name without folders.
+        start_date, end_date, include_minor_items, base_date_selection_on,
+        output_date_format, file_type and output_format: Same as for upload_file.
+    """
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "This resource only accepts POST requests"}, status=405
+        )
+    try:
+        options = {
+            "start_date": request.POST["start_date"],
+            "end_date": request.POST["end_date"],
+            "include_minor_items": request.POST["include_minor_items"],
+            "selected_date_target": request.POST["base_date_selection_on"],
+            "output_date_format": request.POST["output_date_format"],
+            "file_type": request.POST.get("file_type", "single customer"),
+            "output_format": request.POST.get("output_format") or "xlsx",
+        }
+    except KeyError as error:
+        return JsonResponse({"error": f"Missing field {error}"}, status=400)
+    if options["output_format"] not in OUTPUT_FORMATS:
+        return JsonResponse(
+            {"error": f"Unknown output format {options['output_format']}"}, status=400
+        )
+    if not date_interval_is_valid(options["start_date"], options["end_date"]):
+        error_message = INVALID_DATE.format(options["start_date"], options["end_date"])
+        return JsonResponse({"error": error_message}, status=400)
+
+    files = request.FILES.getlist("files") or request.FILES.getlist("file")
+    if not files:
+        return JsonResponse({"error": "No file was uploaded"}, status=400)
+    name = request.POST.get("name", "")
+    if name != "" and safe_file_name(name) != name:
+        return JsonResponse({"error": f"Invalid name {name}"}, status=400)
+    uploads = []
+    for file in files:
+        if len(files) == 1 and name != "":
+            uploads.append((name, file))
+        else:
+            upload_name = safe_file_name(format_file_name(file))
+            if upload_name == "":
+                return JsonResponse(
+                    {"error": f"Invalid file name {file.name}"}, status=400
+                )
+            uploads.append((upload_name, file))
+
+    state = create_job(uploads, options)
+    return job_response(state, status=202)
+
+
+def job_status(request, job_id):
+    """
+    Description: Returns the state of a parse job and each of its files.
+    """
+    state = get_job(job_id)
+    if state is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    return job_response(state)
+
+
+def job_events(request, job_id):
+    """
+    Description: Streams the progress of a parse job as server-sent events, see job_event_stream.
+    """
+    if get_job(job_id) is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    response = StreamingHttpResponse(
+        job_event_stream(job_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # stops nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def job_file_download(request, job_id, index):
+    """
+    Description: Downloads one parsed file of a job as soon as it is ready, while the
+                 other files may still be parsing. Returns status 409 until then.
+    """
+    state = get_job(job_id)
+    if state is None or index >= len(state["files"]):
+        return JsonResponse({"error": "Unknown file"}, status=404)
+    entry = state["files"][index]
+    if entry["status"] != "done":
+        return JsonResponse(
+            {"error": f"File is {entry['status']}", "status": entry["status"]},
+            status=409,
+        )
+    path = os.path.join(job_dir(job_id), "parsed", entry["output"])
+    return download_file(path, entry["output"])
+
+
+def job_download(request, job_id):
+    """
+    Description: Downloads the result of a finished parse job. A job with a single
+                 file returns the parsed file, otherwise the parsed files are zipped.
+                 Returns status 409 while the job is still running.
+    """
+    state = get_job(job_id)
+    if state is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    if state["status"] != "done":
+        return JsonResponse(
+            {"error": f"Job is {state['status']}", "status": state["status"]},
+            status=409,
+        )
+    parsed_path = os.path.join(job_dir(job_id), "parsed")
+    if len(state["files"]) == 1:
+        output_name = state["files"][0]["output"]
+        return download_file(os.path.join(parsed_path, output_name), output_name)
+    return download_folder(parsed_path)
+
+
+def job_cancel(request, job_id):
+    """
+    Description: Cancels a parse job. Queued files are dropped and running files stop
+                 at the next checkpoint of the Parser.
+    """
+    if request.method != "POST":
+        return JsonResponse(
+            {"error": "This resource only accepts POST requests"}, status=405
+        )
+    state = cancel_job(job_id)
+    if state is None:
+        return JsonResponse({"error": "Unknown job"}, status=404)
+    return job_response(state, status=202)
+
+
+def metrics_view(request):
+    """
+    Description: Exposes the parse counters and the per-stage timing histograms
+                 in the Prometheus text format.
+    """
+    content, content_type = metrics.render()
+    return HttpResponse(content, content_type=content_type)
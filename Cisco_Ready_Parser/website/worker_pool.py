@@ -0,0 +1,199 @@
+import importlib
+import multiprocessing
+import multiprocessing.util
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Imported once by every worker before its first job. The web process itself
+# never needs them, so it starts without paying for pandas and openpyxl.
+PRELOAD_MODULES = ["website.parser", "website.snapshots", "openpyxl", "pyxlsb"]
+
+# One per sheet of the report, see get_sheet_pool.
+SHEET_WORKERS = 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_sheet_pool = None
+_sheet_pool_pid = None
+
+
+def available_cores():
+    """
+    Description: Number of cores this process is allowed to run on.
+
+    Returns:
+        int: The number of usable cores, at least 1.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def _mp_context():
+    """
+    Workers are forked from a forkserver that has PRELOAD_MODULES imported, so a new
+    worker starts warm and does not inherit the threads and sockets of the web process.
+    Where there is no forkserver, workers are spawned and import the modules themselves.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _warm_up():
+    # a no-op when the forkserver already imported them
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+
+
+class WorkerPool:
+    """
+    Description: Long-lived pool of parser processes. Workers stay alive between
+                 files and requests and import the parser before their first job,
+                 so the process start and the pandas import are paid once per
+                 worker instead of once per file.
+                 At most max_pending jobs are queued or running at any time;
+                 further submissions block until a slot frees up.
+
+    Args:
+        max_workers (int): Number of worker processes.
+        max_pending (int): Number of jobs allowed in the queue, including running ones.
+    """
+
+    def __init__(self, max_workers, max_pending=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 2
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=_mp_context(),
+            initializer=_warm_up,
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Description: Queues a job, blocking while the queue is full.
+
+        Returns:
+            concurrent.futures.Future: Future of the job's return value.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                future = self._executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed), start a fresh set of workers.
+                self._executor = self._new_executor()
+                future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def as_completed(self, fn, jobs):
+        """
+        Description: Runs fn for every argument tuple in jobs and yields the futures
+                     as they finish. Jobs are submitted lazily, so a large batch
+                     never floods the queue.
+
+        Args:
+            fn (callable): Picklable, module level function to run in the workers.
+            jobs (iterable): Tuples of positional arguments for fn.
+
+        Yields:
+            concurrent.futures.Future: Finished futures, in completion order.
+        """
+        pending = set()
+        for args in jobs:
+            while len(pending) >= self.max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from done
+            pending.add(self.submit(fn, *args))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from done
+
+    def warm_up(self):
+        """
+        Description: Starts every worker ahead of the first job, without waiting for them.
+        """
+        for _ in range(self.max_workers):
+            self.submit(_warm_up)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def get_pool():
+    """
+    Description: Returns the process wide worker pool, creating it on first use.
+                 The pool size comes from the PARSER_WORKERS setting and defaults
+                 to the number of available cores. A server process forked from
+                 the one that created the pool, e.g. by gunicorn --preload, gets
+                 its own pool, the workers of the parent cannot be shared.
+
+    Returns:
+        WorkerPool: The shared pool.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            from django.conf import settings
+
+            workers = getattr(settings, "PARSER_WORKERS", None) or available_cores()
+            _pool = WorkerPool(workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def get_sheet_pool():
+    """
+    Description: Returns the pool the sheets of large xlsx reports are rendered on,
+                 see Parser.PARALLEL_SHEET_ROWS, creating it on first use. It is kept
+                 apart from the pool of get_pool, so a parse running on a worker of
+                 that pool never waits for slots held by its own job. Each process
+                 has its own, and its workers only start with the first large report.
+                 The pool size comes from the PARSER_SHEET_WORKERS setting and
+                 defaults to one per sheet, limited to the available cores.
+
+    Returns:
+        WorkerPool: The sheet pool, None when the sheets are written one after another.
+    """
+    global _sheet_pool, _sheet_pool_pid
+    with _pool_lock:
+        if _sheet_pool is None or _sheet_pool_pid != os.getpid():
+            from django.conf import settings
+
+            workers = getattr(settings, "PARSER_SHEET_WORKERS", None)
+            if workers is None:
+                workers = min(SHEET_WORKERS, available_cores())
+            if workers < 2:
+                return None
+            _sheet_pool = WorkerPool(workers)
+            _sheet_pool_pid = os.getpid()
+            # A pool worker exits through multiprocessing, which joins its children
+            # without the exit hook of the executor, so the pool is shut down first.
+            # The queues of the pool close at exit priority 10, this runs before.
+            multiprocessing.util.Finalize(None, _sheet_pool.shutdown, exitpriority=20)
+        return _sheet_pool
+
+
+def warm_pool():
+    """
+    Description: Starts the workers of the shared pool, see get_pool, when the
+                 PARSER_WARM_WORKERS setting is on. Called once the server has
+                 loaded the application, so the first upload finds them ready.
+    """
+    from django.conf import settings
+
+    if getattr(settings, "PARSER_WARM_WORKERS", False):
+        get_pool().warm_up()
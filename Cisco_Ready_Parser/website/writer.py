@@ -0,0 +1,493 @@
+import datetime
+import io
+import numbers
+import re
+import shutil
+import tempfile
+import zipfile
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+COLUMN_WIDTHS = {
+    "A": 15,
+    "B": 12.5,
+    "C": 20,
+    "D": 59,
+    "E": 28,
+    "F": 15,
+    "G": 20,
+}
+
+# Excel number formats of the output_date_format choices.
+DATE_FORMATS = {
+    "DD/MM/YYYY": "dd/mm/yyyy",
+    "MM/DD/YYYY": "mm/dd/yyyy",
+    "YYYY/MM/DD": "yyyy/mm/dd",
+}
+# strftime formats of the output_date_format choices, for text outputs.
+STRFTIME_FORMATS = {
+    "DD/MM/YYYY": "%d/%m/%Y",
+    "MM/DD/YYYY": "%m/%d/%Y",
+    "YYYY/MM/DD": "%Y/%m/%d",
+}
+# Number format of dates in columns without one, the one openpyxl uses.
+DATETIME_FORMAT = "yyyy-mm-dd h:mm:ss"
+# Ordinal of 1899-12-30, day 0 of Excel's 1900 date system.
+EXCEL_EPOCH = datetime.date(1899, 12, 30).toordinal()
+# Compressed size up to which SpreadsheetWriter keeps a workbook in memory before
+# spilling it to a temporary file.
+SPOOL_BYTES = 32 * 1024**2
+# Characters XML 1.0 does not allow, dropped from the text of the cells.
+ILLEGAL_CHARACTERS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIPS_NS = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+)
+PACKAGE_RELATIONSHIPS_NS = (
+    "http://schemas.openxmlformats.org/package/2006/relationships"
+)
+CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+
+def excel_serial(value):
+    """Excel serial number of a date or datetime."""
+    days = value.toordinal() - EXCEL_EPOCH
+    if 0 < days <= 60:
+        # Excel counts a 29 February 1900 that never was
+        days -= 1
+    if isinstance(value, datetime.datetime):
+        seconds = value.hour * 3600 + value.minute * 60 + value.second
+        seconds += value.microsecond / 1e6
+        if seconds:
+            return days + seconds / 86400
+    return days
+
+
+def _text(value):
+    return escape(ILLEGAL_CHARACTERS.sub("", value))
+
+
+class ReportWriter:
+    """
+    Description: Builds every sheet of the output report in a single openpyxl
+                 workbook and serializes it once when save is called.
+
+    Args:
+        output (str|file): Path or binary file object the workbook is written to.
+        write_only (bool): Use openpyxl's write-only mode, which streams rows
+                           to disk and keeps memory constant for large outputs.
+    """
+
+    def __init__(self, output, write_only=False):
+        self.output = output
+        self.write_only = write_only
+        self.workbook = Workbook(write_only=write_only)
+        if not write_only:
+            self.workbook.remove(self.workbook.active)
+        self.bold_font = Font(bold=True)
+
+    def add_sheet(self, title, header, blocks, number_formats=None):
+        """
+        Description: Writes one sheet: a header row, then for every block a bold
+                     category row followed by the block's rows and a blank row.
+
+        Args:
+            title (str): Name of the sheet.
+            header (list): Column names written in the first row.
+            blocks (iterable): (category, columns) pairs, columns being equally long
+                               sequences of cell values, missing values as None.
+                               Empty blocks are skipped.
+            number_formats (dict): Excel number format per column position, e.g. to
+                                   show datetime values as dates.
+        """
+        number_formats = number_formats or {}
+        worksheet = self.workbook.create_sheet(title)
+        for column, width in COLUMN_WIDTHS.items():
+            worksheet.column_dimensions[column].width = width
+
+        worksheet.append(header)
+        for category, columns in blocks:
+            if not len(columns[0]):
+                continue
+            category_cell = WriteOnlyCell(worksheet, value=category)
+            category_cell.font = self.bold_font
+            worksheet.append([category_cell])
+            for row in zip(*columns):
+                if number_formats:
+                    row = list(row)
+                    for position, number_format in number_formats.items():
+                        if row[position] is not None:
+                            cell = WriteOnlyCell(worksheet, value=row[position])
+                            cell.number_format = number_format
+                            row[position] = cell
+                worksheet.append(row)
+            worksheet.append([])
+
+    def save(self):
+        self.workbook.save(self.output)
+
+
+class SpreadsheetWriter:
+    """
+    Description: Same interface as ReportWriter, but writes the SpreadsheetML of the
+                 workbook directly from the column values instead of building openpyxl
+                 cells. Rows are compressed as they are written, in memory up to
+                 SPOOL_BYTES and in a temporary file beyond, so memory stays bounded
+                 apart from the shared strings table, which holds every distinct text,
+                 like a Product ID or a description, once.
+                 Nothing is written to output before save.
+
+    Args:
+        output (str|file): Path or binary file object the workbook is written to.
+        shared_strings (bool): Store text in the shared strings table. Without it text
+                               is written inline, so sheets rendered by separate writers
+                               can be combined, see render_sheet.
+    """
+
+    def __init__(self, output, shared_strings=True):
+        self.output = output
+        self.strings = {} if shared_strings else None
+        self.titles = []
+        self.file = None
+        self.archive = None
+        # (bold, number format) -> style id, in the order the styles were first used
+        self.styles = {}
+        self._style(False, None)
+        self.bold_style = self._style(True, None)
+        self.date_style = self._style(False, DATETIME_FORMAT)
+
+    def _style(self, bold, number_format):
+        return self.styles.setdefault((bold, number_format), len(self.styles))
+
+    def _open_sheet(self, title):
+        if self.archive is None:
+            self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+            self.archive = zipfile.ZipFile(self.file, "w", zipfile.ZIP_DEFLATED)
+        self.titles.append(title)
+        return self.archive.open(f"xl/worksheets/sheet{len(self.titles)}.xml", "w")
+
+    def add_sheet(self, title, header, blocks, number_formats=None):
+        """
+        Description: Writes one sheet, see ReportWriter.add_sheet.
+        """
+        with self._open_sheet(title) as part:
+            self.write_sheet(part, header, blocks, number_formats)
+
+    def add_rendered_sheet(self, title, data, number_formats=None):
+        """
+        Description: Adds the XML of a sheet written by write_sheet of another writer
+                     with the same number_formats, see assemble_workbook.
+        """
+        # registered in the order write_sheet registers them, so the style ids match
+        for number_format in (number_formats or {}).values():
+            self._style(False, number_format)
+        with self._open_sheet(title) as part:
+            part.write(data)
+
+    def write_sheet(self, stream, header, blocks, number_formats=None):
+        """
+        Description: Writes the XML of one sheet to a binary stream, see
+                     ReportWriter.add_sheet for the arguments.
+        """
+        number_formats = number_formats or {}
+        formats = {
+            position: self._style(False, number_format)
+            for position, number_format in number_formats.items()
+        }
+        columns_xml = "".join(
+            f'<col min="{index}" max="{index}" width="{width}" customWidth="1"/>'
+            for index, width in (
+                (column_index_from_string(column), width)
+                for column, width in COLUMN_WIDTHS.items()
+            )
+        )
+        stream.write(
+            f'{XML_DECLARATION}<worksheet xmlns="{MAIN_NS}">'
+            '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+            '<sheetFormatPr defaultRowHeight="15"/>'
+            f"<cols>{columns_xml}</cols><sheetData>".encode()
+        )
+
+        letters = []
+        rows = []
+        number = 1
+        rows.append(self._row(number, header, letters, [0] * len(header)))
+        for category, columns in blocks:
+            if not len(columns[0]):
+                continue
+            number += 1
+            rows.append(self._row(number, [category], letters, [self.bold_style]))
+            styles = [formats.get(position, 0) for position in range(len(columns))]
+            for row in zip(*columns):
+                number += 1
+                rows.append(self._row(number, row, letters, styles))
+                if len(rows) >= 1024:
+                    stream.write("".join(rows).encode())
+                    rows = []
+            number += 1
+            rows.append(f'<row r="{number}"/>')
+        rows.append("</sheetData></worksheet>")
+        stream.write("".join(rows).encode())
+
+    def _row(self, number, values, letters, styles):
+        while len(letters) < len(values):
+            letters.append(get_column_letter(len(letters) + 1))
+        strings = self.strings
+        cells = []
+        for letter, value, style in zip(letters, values, styles):
+            if value is None:
+                continue
+            reference = f'r="{letter}{number}"'
+            attributes = f'{reference} s="{style}"' if style else reference
+            if isinstance(value, str):
+                if strings is None:
+                    cells.append(
+                        f'<c {attributes} t="inlineStr"><is>'
+                        f'<t xml:space="preserve">{_text(value)}</t></is></c>'
+                    )
+                    continue
+                index = strings.get(value)
+                if index is None:
+                    index = strings[value] = len(strings)
+                cells.append(f'<c {attributes} t="s"><v>{index}</v></c>')
+            elif isinstance(value, (bool, np.bool_)):
+                cells.append(f'<c {attributes} t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, numbers.Number):
+                if value == value:
+                    cells.append(f"<c {attributes}><v>{value}</v></c>")
+            elif isinstance(value, datetime.date):
+                if not style:
+                    attributes = f'{reference} s="{self.date_style}"'
+                cells.append(f"<c {attributes}><v>{excel_serial(value)}</v></c>")
+            else:
+                # anything else is shown as text, like the tables do
+                cells.append(
+                    f'<c {attributes} t="inlineStr"><is>'
+                    f'<t xml:space="preserve">{_text(str(value))}</t></is></c>'
+                )
+        return f'<row r="{number}">{"".join(cells)}</row>'
+
+    def save(self):
+        if self.archive is None:
+            raise ValueError("A workbook needs at least one sheet")
+        archive = self.archive
+        sheets = range(1, len(self.titles) + 1)
+
+        archive.writestr(
+            "[Content_Types].xml",
+            f'{XML_DECLARATION}<Types xmlns="{CONTENT_TYPES_NS}">'
+            '<Default Extension="rels" '
+            'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(
+                f'<Override PartName="/xl/worksheets/sheet{sheet}.xml" ContentType="'
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+                'worksheet+xml"/>'
+                for sheet in sheets
+            )
+            + '<Override PartName="/xl/styles.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            "</Types>",
+        )
+        archive.writestr(
+            "_rels/.rels",
+            f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_RELATIONSHIPS_NS}">'
+            f'<Relationship Id="rId1" Type="{RELATIONSHIPS_NS}/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>',
+        )
+        archive.writestr(
+            "xl/workbook.xml",
+            f'{XML_DECLARATION}<workbook xmlns="{MAIN_NS}" '
+            f'xmlns:r="{RELATIONSHIPS_NS}">'
+            "<bookViews><workbookView/></bookViews><sheets>"
+            + "".join(
+                f'<sheet name={quoteattr(title)} sheetId="{sheet}" r:id="rId{sheet}"/>'
+                for sheet, title in zip(sheets, self.titles)
+            )
+            + "</sheets></workbook>",
+        )
+        archive.writestr(
+            "xl/_rels/workbook.xml.rels",
+            f'{XML_DECLARATION}<Relationships xmlns="{PACKAGE_RELATIONSHIPS_NS}">'
+            + "".join(
+                f'<Relationship Id="rId{sheet}" Type="{RELATIONSHIPS_NS}/worksheet" '
+                f'Target="worksheets/sheet{sheet}.xml"/>'
+                for sheet in sheets
+            )
+            + f'<Relationship Id="rId{len(sheets) + 1}" '
+            f'Type="{RELATIONSHIPS_NS}/styles" Target="styles.xml"/>'
+            f'<Relationship Id="rId{len(sheets) + 2}" '
+            f'Type="{RELATIONSHIPS_NS}/sharedStrings" Target="sharedStrings.xml"/>'
+            "</Relationships>",
+        )
+        archive.writestr("xl/styles.xml", self._styles_xml())
+        with archive.open("xl/sharedStrings.xml", "w") as part:
+            strings = self.strings or {}
+            part.write(
+                f'{XML_DECLARATION}<sst xmlns="{MAIN_NS}" '
+                f'uniqueCount="{len(strings)}">'.encode()
+            )
+            items = []
+            for text in strings:
+                items.append(f'<si><t xml:space="preserve">{_text(text)}</t></si>')
+                if len(items) >= 1024:
+                    part.write("".join(items).encode())
+                    items = []
+            items.append("</sst>")
+            part.write("".join(items).encode())
+        archive.close()
+
+        self.file.seek(0)
+        if isinstance(self.output, str):
+            with open(self.output, "wb") as f:
+                shutil.copyfileobj(self.file, f)
+        else:
+            shutil.copyfileobj(self.file, self.output)
+        self.file.close()
+
+    def _styles_xml(self):
+        number_format_ids = {}
+        cell_styles = []
+        for bold, number_format in self.styles:
+            attributes = f'fontId="{int(bold)}"' + (' applyFont="1"' if bold else "")
+            if number_format is not None:
+                # ids below 164 are Excel's built in formats
+                format_id = number_format_ids.setdefault(
+                    number_format, 164 + len(number_format_ids)
+                )
+                attributes += f' numFmtId="{format_id}" applyNumberFormat="1"'
+            else:
+                attributes += ' numFmtId="0"'
+            cell_styles.append(f'<xf {attributes} fillId="0" borderId="0" xfId="0"/>')
+        number_formats = "".join(
+            f'<numFmt numFmtId="{format_id}" formatCode={quoteattr(number_format)}/>'
+            for number_format, format_id in number_format_ids.items()
+        )
+        font = '<sz val="11"/><name val="Calibri"/><family val="2"/>'
+        return (
+            f'{XML_DECLARATION}<styleSheet xmlns="{MAIN_NS}">'
+            f'<numFmts count="{len(number_format_ids)}">{number_formats}</numFmts>'
+            f'<fonts count="2"><font>{font}</font><font><b/>{font}</font></fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/>'
+            "</border></borders>"
+            '<cellStyleXfs count="1">'
+            '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            f'<cellXfs count="{len(cell_styles)}">{"".join(cell_styles)}</cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/>'
+            "</cellStyles></styleSheet>"
+        )
+
+
+def render_sheet(header, blocks, number_formats=None):
+    """
+    Description: Renders the XML of one sheet with its text inline, so the sheets of a
+                 workbook can be rendered by separate processes and combined with
+                 assemble_workbook. See ReportWriter.add_sheet for the arguments.
+
+    Returns:
+        bytes: The zlib compressed XML of the sheet.
+    """
+    stream = io.BytesIO()
+    writer = SpreadsheetWriter(None, shared_strings=False)
+    writer.write_sheet(stream, header, blocks, number_formats)
+    # only compressed for the way back from the worker, the fastest level will do
+    return zlib.compress(stream.getvalue(), 1)
+
+
+def assemble_workbook(output, titles, parts, number_formats=None):
+    """
+    Description: Combines sheets rendered by render_sheet into one workbook.
+
+    Args:
+        output (str|file): Path or binary file object the workbook is written to.
+        titles (list): Names of the sheets, in workbook order.
+        parts (list): Result of render_sheet for every sheet, in the same order.
+        number_formats (dict): Number formats every sheet was rendered with.
+    """
+    writer = SpreadsheetWriter(output)
+    for title, part in zip(titles, parts):
+        writer.add_rendered_sheet(title, zlib.decompress(part), number_formats)
+    writer.save()
+
+
+class TableWriter:
+    """
+    Description: Same interface as ReportWriter, but writes the rows of every sheet
+                 into one flat table instead of a workbook. Each row carries the
+                 sheet and the portfolio it belongs to, and the date of interest of
+                 the sheet is stored in a common Date column.
+
+    Args:
+        output (str|file): Path or binary file object the table is written to.
+        output_format (str): csv, jsonl or parquet.
+        output_date_format (str): Format of the dates in csv files. JSON Lines use
+                                  ISO 8601 dates and Parquet native timestamps.
+    """
+
+    def __init__(self, output, output_format, output_date_format="YYYY/MM/DD"):
+        self.output = output
+        self.output_format = output_format
+        self.output_date_format = output_date_format
+        self.columns = None
+        self.frames = []
+
+    def add_sheet(self, title, header, blocks, number_formats=None):
+        """
+        Description: Adds the rows of one sheet, see ReportWriter.add_sheet.
+                     The date of interest is expected in the fifth column.
+        """
+        names = ["Sheet", "Portfolio"] + header
+        names[6] = "Date"
+        self.columns = names
+        for category, columns in blocks:
+            if not len(columns[0]):
+                continue
+            frame = pd.DataFrame(dict(zip(names[2:], columns))).infer_objects()
+            frame.insert(0, "Sheet", title)
+            frame.insert(1, "Portfolio", category)
+            frame["Date"] = pd.to_datetime(frame["Date"])
+            self.frames.append(frame)
+
+    def save(self):
+        if self.frames:
+            table = pd.concat(self.frames, ignore_index=True)
+        else:
+            table = pd.DataFrame(columns=self.columns)
+        for name in ["Sheet", "Portfolio"]:
+            table[name] = table[name].astype("category")
+
+        if self.output_format == "parquet":
+            # a Parquet column holds one type, a Product ID column mixing
+            # numbers and text is stored as text
+            for name in table.columns:
+                if pd.api.types.infer_dtype(table[name]) in ("mixed", "mixed-integer"):
+                    values = table[name]
+                    table[name] = values.astype(str).where(values.notna(), None)
+            table.to_parquet(self.output, index=False)
+            return
+        if self.output_format == "csv":
+            content = table.to_csv(
+                index=False, date_format=STRFTIME_FORMATS[self.output_date_format]
+            )
+        else:
+            content = table.to_json(orient="records", lines=True, date_format="iso")
+        if isinstance(self.output, str):
+            with open(self.output, "w", encoding="utf-8", newline="") as f:
+                f.write(content)
+        else:
+            self.output.write(content.encode("utf-8"))
@@ -0,0 +1,67 @@
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+# Members that are compressed archives already, deflating them again only costs CPU.
+STORED_EXTENSIONS = (".xlsx", ".xlsb", ".zip", ".parquet", ".gz")
+
+
+class _ChunkWriter:
+    """
+    Description: Write-only, unseekable file object collecting what ZipFile writes,
+                 so it can be handed out chunk by chunk instead of kept in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    Description: Builds a zip archive on the fly and yields it piece by piece.
+                 Entries are read lazily, so the first files can be sent while
+                 the next ones are still being produced. Files that are already
+                 compressed are stored without recompression.
+
+    Args:
+        entries (iterable): (path, name in archive) or (path, name in archive, comment) tuples.
+                            The path may also be a binary file object, e.g. an in-memory buffer.
+
+    Yields:
+        bytes: The next part of the archive.
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode="w") as archive:
+        for entry in entries:
+            path, name = entry[0], entry[1]
+            if hasattr(path, "read"):
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                path.seek(0)
+            else:
+                info = zipfile.ZipInfo.from_file(path, name)
+            if len(entry) > 2:
+                info.comment = entry[2].encode()
+            if name.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            source = path if hasattr(path, "read") else open(path, "rb")
+            with source, archive.open(info, "w") as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    target.write(chunk)
+                    if writer.chunks:
+                        yield writer.pop()
+            yield writer.pop()
+    yield writer.pop()